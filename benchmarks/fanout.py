@@ -0,0 +1,118 @@
+"""
+Micro-benchmark: CPU spent fanning one chat message out to a room.
+
+Compares the old per-recipient ``json.dumps`` in ChatConsumer.chat_message
+with the shipped path: the sender builds the event with groups.frame_event
+and each recipient's handler picks its payload with encoding.frame_payload.
+That path is run with the standard library and, when installed, orjson,
+and with msgpack clients connected, since frame_event then also encodes
+for their codecs. Only serialization is measured; the channel layer and
+sockets are left out.
+
+    python benchmarks/fanout.py --recipients 10 100 1000 --messages 2000
+    python benchmarks/fanout.py --json > fanout.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chat_app.settings')
+os.environ.setdefault('CHAT_WIRE_PROTOCOLS', 'chat.json chat.msgpack chat.msgpack.deflate')
+
+from chat import encoding  # noqa: E402
+from chat.encoding import codec_closed, codec_opened, frame_payload, get_codecs, get_json_encoder, orjson  # noqa: E402
+from chat.groups import frame_event  # noqa: E402
+
+
+def sample_frame(i):
+    return {
+        'type': 'chat_message',
+        'message': f'Message number {i}: the quick brown fox jumps over the lazy dog',
+        'user': 'someone',
+        'user_id': 42,
+    }
+
+
+def per_recipient(frame, recipients, encode):
+    # Old behaviour: every recipient's chat_message handler rebuilt and encoded the frame
+    for _ in range(recipients):
+        encode({
+            'type': 'chat_message',
+            'message': frame['message'],
+            'user': frame['user'],
+            'user_id': frame['user_id'],
+        })
+
+
+def pre_encoded(frame, recipients, encode):
+    # Shipped behaviour: the sender encodes once per codec in use, handlers
+    # forward their payload. encode is the JSON encoder frame_event uses.
+    encoding._dumps = encode
+    event = frame_event('chat_message', frame)
+    json_codec = get_codecs()['json']
+    for _ in range(recipients):
+        frame_payload(event['frames'], json_codec)
+
+
+def with_codecs(names):
+    """pre_encoded while connections using the named codecs are open"""
+    def strategy(frame, recipients, encode):
+        codecs = [get_codecs()[name] for name in names]
+        for codec in codecs:
+            codec_opened(codec)
+        try:
+            pre_encoded(frame, recipients, encode)
+        finally:
+            for codec in codecs:
+                codec_closed(codec)
+    return strategy
+
+
+def run(strategy, encode, recipients, messages):
+    frames = [sample_frame(i) for i in range(messages)]
+    started = time.process_time()
+    for frame in frames:
+        strategy(frame, recipients, encode)
+    elapsed = time.process_time() - started
+    return elapsed / messages * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recipients', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    args = parser.parse_args()
+
+    variants = [('per_recipient_json', per_recipient, json.dumps)]
+    variants.append(('pre_encoded_json', pre_encoded, get_json_encoder('json')))
+    if orjson is not None:
+        variants.append(('pre_encoded_orjson', pre_encoded, get_json_encoder('orjson')))
+    fastest = get_json_encoder('auto')
+    if encoding.msgpack is not None:
+        variants.append(('pre_encoded_with_msgpack', with_codecs(['msgpack']), fastest))
+        variants.append(('pre_encoded_with_all', with_codecs(['msgpack', 'msgpack.deflate']), fastest))
+
+    results = []
+    for recipients in args.recipients:
+        for name, strategy, encode in variants:
+            results.append({
+                'variant': name,
+                'recipients': recipients,
+                'cpu_us_per_message': round(run(strategy, encode, recipients, args.messages), 2),
+            })
+
+    if args.json:
+        print(json.dumps({'messages': args.messages, 'results': results}, indent=2))
+        return
+
+    print(f"{'variant':<26} {'recipients':>10} {'cpu us/message':>15}")
+    for row in results:
+        print(f"{row['variant']:<26} {row['recipients']:>10} {row['cpu_us_per_message']:>15}")
+
+
+if __name__ == '__main__':
+    main()
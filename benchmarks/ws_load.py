@@ -0,0 +1,302 @@
+"""
+Load benchmark: the whole WebSocket chat pipeline, in one process.
+
+Drives chat_app.asgi.application through channels' WebsocketCommunicator
+against a fresh temporary SQLite database and an in-process channel layer,
+so nothing but this interpreter is needed. N rooms of M clients connect
+(JWT in the query string, as real clients do), then every client sends
+messages at a fixed rate while all of them record when each message
+reaches them. Reported:
+
+    connect latency          p50/p99/max per connection
+    fan-out latency          send -> delivery to each room member, p50/p90/p99/max
+    throughput               messages/sec accepted, deliveries/sec
+    database                 queries and query time per message sent
+
+Rate limits are lifted for the run.
+
+    python benchmarks/ws_load.py --rooms 10 --clients 10 --rate 2 --duration 10
+    python benchmarks/ws_load.py --persistence write_behind --json > load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--clients', type=int, default=10, help='clients per room')
+    parser.add_argument('--rate', type=float, default=1.0, help='messages per second per client')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds of sending')
+    parser.add_argument('--layer', choices=['local', 'inmemory'], default='local',
+                        help='chat.layers.LocalChannelLayer or channels.layers.InMemoryChannelLayer')
+    parser.add_argument('--persistence', choices=['sync', 'write_behind'], default='sync')
+    parser.add_argument('--db-threads', type=int, default=0, help='CHAT_DB_THREADS (0: one shared thread)')
+    parser.add_argument('--drain-timeout', type=float, default=10.0,
+                        help='seconds to wait for outstanding deliveries after sending stops')
+    parser.add_argument('--json', action='store_true', help='print machine-readable results')
+    return parser.parse_args()
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Nearest-rank percentiles and max of samples, in milliseconds"""
+    if not samples:
+        return {**{f'p{point}': None for point in points}, 'max': None}
+    ordered = sorted(samples)
+    result = {}
+    for point in points:
+        index = max(0, min(len(ordered) - 1, round(point / 100 * len(ordered)) - 1))
+        result[f'p{point}'] = round(ordered[index] * 1000, 3)
+    result['max'] = round(ordered[-1] * 1000, 3)
+    return result
+
+
+class QueryCounter:
+    """
+    Execute wrapper counting queries and their time on every connection.
+
+    Connection setup (chat.db's PRAGMAs) is not a query of the code under
+    test and is left out; the run keeps connections open (CONN_MAX_AGE) so
+    there is little of it anyway.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() == 'PRAGMA':
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - started
+            self.queries += 1
+
+    def install(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+def setup_fixtures(rooms, clients):
+    """Create users and group rooms; returns [(room_id, [user, ...]), ...]"""
+    from django.contrib.auth.models import User
+    from chat.models import ChatRoom
+
+    # Password hashing would dominate setup; the benchmark only uses tokens
+    User.objects.bulk_create([
+        User(username=f'load{room}_{client}', password='!')
+        for room in range(rooms) for client in range(clients)
+    ])
+    users = list(User.objects.filter(username__startswith='load').order_by('id'))
+    layout = []
+    for room in range(rooms):
+        members = users[room * clients:(room + 1) * clients]
+        chat_room = ChatRoom.objects.create(name=f'load room {room}', created_by=members[0])
+        chat_room.participants.add(*members)
+        layout.append((chat_room.id, members))
+    return layout
+
+
+class Client:
+    def __init__(self, application, room_id, user, token, sent):
+        from channels.testing import WebsocketCommunicator
+
+        self.room_id = room_id
+        self.user = user
+        self.communicator = WebsocketCommunicator(application, f'/ws/chat/{room_id}/?token={token}')
+        self.sent = sent  # shared: message text -> perf_counter at send
+        self.latencies = []
+        self.received = 0
+        self.errors = 0
+
+    async def connect(self):
+        started = time.perf_counter()
+        connected, _ = await self.communicator.connect(timeout=30)
+        if not connected:
+            raise RuntimeError(f'client {self.user.username} was rejected')
+        await self.communicator.receive_output(timeout=30)  # connection_established
+        return time.perf_counter() - started
+
+    async def listen(self):
+        # Never time out here: a timed-out receive cancels the application
+        while True:
+            output = await self.communicator.receive_output(timeout=3600)
+            if output['type'] != 'websocket.send':
+                continue
+            frame = json.loads(output['text'])
+            if frame.get('type') == 'chat_message':
+                sent_at = self.sent.get(frame['message'])
+                if sent_at is not None:
+                    self.latencies.append(time.perf_counter() - sent_at)
+                    self.received += 1
+            elif frame.get('type') == 'error':
+                self.errors += 1
+
+    async def send(self, rate, duration, offset):
+        interval = 1 / rate
+        started = time.perf_counter() + offset
+        count = int(duration * rate)
+        for seq in range(count):
+            delay = started + seq * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text = f'{self.user.id}:{seq}'
+            self.sent[text] = time.perf_counter()
+            await self.communicator.send_to(text_data=json.dumps({'message': text}))
+        return count
+
+
+async def run(args, counter):
+    from rest_framework_simplejwt.tokens import AccessToken
+    from channels.db import database_sync_to_async
+    from chat_app.asgi import application
+    from chat.outbound import outbound_metrics
+
+    layout = await database_sync_to_async(setup_fixtures)(args.rooms, args.clients)
+    sent = {}
+    clients = [
+        Client(application, room_id, user, str(AccessToken.for_user(user)), sent)
+        for room_id, members in layout for user in members
+    ]
+
+    connect_started = time.perf_counter()
+    connect_latencies = [await client.connect() for client in clients]
+    connect_seconds = time.perf_counter() - connect_started
+
+    listeners = [asyncio.ensure_future(client.listen()) for client in clients]
+    # Let presence join notifications settle before measuring
+    await asyncio.sleep(0.5)
+
+    queries_before, query_seconds_before = counter.queries, counter.seconds
+    load_started = time.perf_counter()
+    spread = 1 / args.rate
+    counts = await asyncio.gather(*(
+        client.send(args.rate, args.duration, spread * index / len(clients))
+        for index, client in enumerate(clients)
+    ))
+    send_seconds = time.perf_counter() - load_started
+    messages = sum(counts)
+
+    expected = messages * args.clients
+    deadline = time.perf_counter() + args.drain_timeout
+    while sum(client.received for client in clients) < expected and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    load_seconds = time.perf_counter() - load_started
+
+    if args.persistence == 'write_behind':
+        from chat.persistence import get_message_buffer
+        await get_message_buffer().flush()
+    queries = counter.queries - queries_before
+    query_seconds = counter.seconds - query_seconds_before
+
+    for listener in listeners:
+        listener.cancel()
+    await asyncio.gather(*listeners, return_exceptions=True)
+    for client in clients:
+        await client.communicator.disconnect()
+
+    delivered = sum(client.received for client in clients)
+    fanout = [latency for client in clients for latency in client.latencies]
+    return {
+        'connections': len(clients),
+        'connect_seconds': round(connect_seconds, 3),
+        'connect_latency_ms': percentiles(connect_latencies),
+        'messages_sent': messages,
+        'deliveries_expected': expected,
+        'deliveries': delivered,
+        'deliveries_missing': expected - delivered,
+        'errors': sum(client.errors for client in clients),
+        'send_seconds': round(send_seconds, 3),
+        'messages_per_second': round(messages / load_seconds, 1) if load_seconds else None,
+        'deliveries_per_second': round(delivered / load_seconds, 1) if load_seconds else None,
+        'fanout_latency_ms': percentiles(fanout),
+        'fanout_latency_mean_ms': round(statistics.fmean(fanout) * 1000, 3) if fanout else None,
+        'db_queries': queries,
+        'db_queries_per_message': round(queries / messages, 3) if messages else None,
+        'db_ms_per_message': round(query_seconds * 1000 / messages, 3) if messages else None,
+        'outbound': outbound_metrics.stats(),
+    }
+
+
+def main():
+    args = parse_args()
+    database = tempfile.NamedTemporaryFile(prefix='chat-load-', suffix='.sqlite3', delete=False)
+    database.close()
+
+    # Configure the app before Django reads its settings
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'chat_app.settings'
+    os.environ['SQLITE_PATH'] = database.name
+    os.environ['CHANNEL_LAYER'] = 'local'
+    os.environ['CHAT_PERSISTENCE_MODE'] = args.persistence
+    os.environ['CHAT_DB_THREADS'] = str(args.db_threads)
+    # Persistent connections, as in production; with the development
+    # default of 0 every database call would open a new one
+    os.environ.setdefault('CONN_MAX_AGE', '600')
+    os.environ.setdefault('CHAT_LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('DEBUG', '0')
+
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db.backends.signals import connection_created
+
+    if args.layer == 'inmemory':
+        settings.CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+    unlimited = {'RATE': 10 ** 9, 'BURST': 10 ** 9}
+    settings.CHAT_RATE_LIMITS = {**settings.CHAT_RATE_LIMITS, 'USER': unlimited, 'ROOM': unlimited}
+
+    try:
+        call_command('migrate', verbosity=0)
+        counter = QueryCounter()
+        connection_created.connect(counter.install)
+        results = asyncio.run(run(args, counter))
+    finally:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(database.name + suffix):
+                os.remove(database.name + suffix)
+
+    report = {
+        'config': {
+            'rooms': args.rooms,
+            'clients_per_room': args.clients,
+            'rate_per_client': args.rate,
+            'duration': args.duration,
+            'layer': args.layer,
+            'persistence': args.persistence,
+            'db_threads': args.db_threads,
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'sqlite': sqlite3.sqlite_version,
+        },
+        'results': results,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    for key, value in report['config'].items():
+        print(f'{key:<24} {value}')
+    print()
+    for key, value in results.items():
+        if isinstance(value, dict):
+            value = '  '.join(f'{name}={number}' for name, number in value.items())
+        print(f'{key:<24} {value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -15,7 +15,7 @@ class ChatRoomAdmin(admin.ModelAdmin):
 class MessageAdmin(admin.ModelAdmin):
     list_display = ['user', 'room', 'content_preview', 'timestamp']
     list_filter = ['room', 'timestamp']
-    search_fields = ['user', 'content']
+    search_fields = ['user__username', 'content']
     readonly_fields = ['timestamp']
     
     def content_preview(self, obj):
@@ -2,4 +2,9 @@ from django.apps import AppConfig
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'chat'
\ No newline at end of file
+    name = 'chat'
+
+    def ready(self):
+        from . import db, signals  # noqa: F401
+        from .persistence import check_persistence_settings
+        check_persistence_settings()
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .db import database_sync_to_async
+from .metrics import register_stats
+
+AUTH_CACHE_DEFAULTS = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,
+}
+
+
+@database_sync_to_async
+def fetch_user(user_id):
+    """Load an active user by id"""
+    return User.objects.filter(id=user_id, is_active=True).first()
+
+
+class TokenUserCache:
+    """
+    Bounded LRU cache of users resolved from JWT access tokens.
+
+    Entries are keyed by the token's ``jti`` and live until the token expires
+    or ``ttl`` seconds pass, whichever is sooner, so a deactivated user is
+    locked out within ``ttl``. Concurrent misses for the same user share one
+    in-flight database query.
+
+    ``invalidate`` is called from ``post_save`` on whatever thread saved the
+    user, so the entries and the per-user key index are only touched under
+    a lock. A load that overlaps an invalidation is not cached.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+        self._invalidations = 0
+        self._inflight = {}
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    async def get_user(self, access_token):
+        """Return the user for a validated AccessToken, or None"""
+        user_id = access_token[jwt_settings.USER_ID_CLAIM]
+        key = access_token.get(jwt_settings.JTI_CLAIM) or (user_id, access_token['exp'])
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                user, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return user
+                self._remove(key)
+            invalidations = self._invalidations
+
+        user = await self._load(user_id)
+        if user is not None:
+            with self._lock:
+                if invalidations == self._invalidations:
+                    self._entries[key] = (user, min(access_token['exp'], now + self.ttl))
+                    self._entries.move_to_end(key)
+                    self._keys_by_user.setdefault(user.id, set()).add(key)
+                    while len(self._entries) > self.max_size:
+                        self._remove(next(iter(self._entries)))
+                        self.evictions += 1
+        return user
+
+    def _remove(self, key):
+        # Caller holds the lock
+        user, _ = self._entries.pop(key)
+        keys = self._keys_by_user.get(user.id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user.id]
+
+    async def _load(self, user_id):
+        future = self._inflight.get(user_id)
+        if future is not None:
+            self.coalesced += 1
+            return await asyncio.shield(future)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[user_id] = future
+        try:
+            user = await fetch_user(user_id)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(user)
+            return user
+        finally:
+            del self._inflight[user_id]
+
+    def invalidate(self, user_id=None):
+        """Drop cached entries for one user, or everything; safe from any thread"""
+        with self._lock:
+            self._invalidations += 1
+            if user_id is None:
+                self._entries.clear()
+                self._keys_by_user.clear()
+                return
+            for key in self._keys_by_user.pop(user_id, ()):
+                self._entries.pop(key, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+_token_user_cache = None
+
+
+def get_token_user_cache():
+    """Return the process-wide token user cache, creating it on first use"""
+    global _token_user_cache
+    if _token_user_cache is None:
+        conf = {**AUTH_CACHE_DEFAULTS, **getattr(settings, 'CHAT_AUTH_CACHE', {})}
+        _token_user_cache = TokenUserCache(max_size=conf['MAX_SIZE'], ttl=conf['TTL'])
+        register_stats('chat_token_cache', _token_user_cache.stats, 'WebSocket token user cache')
+    return _token_user_cache
+
+
+async def get_user_from_token(raw_token):
+    """Validate a raw JWT access token and return its user, or None"""
+    try:
+        access_token = AccessToken(raw_token)
+    except TokenError:
+        return None
+    return await get_token_user_cache().get_user(access_token)
@@ -1,172 +1,640 @@
 import json
+import logging
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from django.contrib.auth.models import User
-from .models import ChatRoom, Message
+from django.conf import settings
+from .db import database_sync_to_async
+from .encoding import FrameTooLarge, codec_closed, codec_opened, frame_payload, negotiate_codec
+from .groups import frame_event, room_group_name, send_to_group
+from .log import log_event
+from .metrics import (
+    get_metrics_settings, payload_size, ws_bytes_received, ws_bytes_sent, ws_connections, ws_connects,
+    ws_disconnects, ws_frames_received, ws_frames_sent, ws_rejects, ws_room_connections,
+)
+from .outbound import OutboundQueue, get_outbound_settings, server_transport
+from .models import ChatRoom, Message, RoomParticipant
+from .pagination import get_resume_settings, is_valid_id, message_position, newer_than, parse_id
+from .persistence import get_message_buffer, write_behind_enabled
+from .presence import get_presence
+from .ratelimit import get_rate_limit_settings, get_rate_limiter
+from .typing_indicators import get_typing
 
-class ChatConsumer(AsyncWebsocketConsumer):
-    async def connect(self):
-        print("=" * 60)
-        print("🔄 WebSocket CONNECT attempt - DEBUG VERSION")
-        print("=" * 60)
-        
-        # Debug scope information
-        print(f"📋 Scope keys: {list(self.scope.keys())}")
-        print(f"👤 User in scope: {self.scope.get('user')}")
-        print(f"🔗 Path: {self.scope.get('path')}")
-        print(f"📝 Headers: {self.scope.get('headers')}")
-        
-        # Get room name from URL
-        self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = f'chat_{self.room_name}'
+logger = logging.getLogger(__name__)
+
+MULTIPLEX_DEFAULTS = {
+    'MAX_ROOMS': 100,
+}
+
+
+def get_multiplex_settings():
+    return {**MULTIPLEX_DEFAULTS, **getattr(settings, 'CHAT_MULTIPLEX', {})}
+
+
+class BaseChatConsumer(AsyncWebsocketConsumer):
+    """
+    Frame handling shared by the single-room and the multiplexed endpoint.
+
+    Everything that acts on a room takes it as an argument, so one
+    connection can serve one room or many.
+    """
 
-        print(f"🎯 Room name: {self.room_name}")
-        print(f"🎯 Room group name: {self.room_group_name}")
+    endpoint = None  # metrics label
 
+    def setup_state(self):
+        self.limits = get_rate_limit_settings()
+        self.per_room_metrics = get_metrics_settings()['PER_ROOM']
+        self.violations = 0
+        self.resumed = set()  # rooms this session already replayed
         # Get user from scope
         self.user = self.scope.get("user")
-        print(f"👤 User object: {self.user}")
-        print(f"🔐 Is authenticated: {getattr(self.user, 'is_authenticated', 'NO USER OBJECT')}")
-        
-        # Check query string for token
-        query_string = self.scope.get('query_string', b'').decode()
-        print(f"🔍 Query string: {query_string}")
-        
-        # If user is anonymous, try to authenticate via token
-        if not self.user or self.user.is_anonymous:
-            print("🔑 Attempting token authentication...")
-            if 'token=' in query_string:
-                token = query_string.split('token=')[1].split('&')[0]
-                print(f"🔑 Token found: {token[:50]}...")
-                user = await self.get_user_from_token(token)
-                if user:
-                    self.user = user
-                    self.scope['user'] = user
-                    print(f"✅ Token auth successful! User: {user.username}")
-                else:
-                    print("❌ Token auth failed")
+
+    async def open_socket(self):
+        """Create the outbound queue, negotiate the wire protocol and accept"""
+        # Broadcasts reach the socket through a bounded per-connection queue
+        outbound_conf = get_outbound_settings()
+        self.outbound = OutboundQueue(
+            self.send,
+            self.close,
+            max_size=outbound_conf['MAX_SIZE'],
+            policy=outbound_conf['POLICY'],
+            close_code=outbound_conf['CLOSE_CODE'],
+            transport=server_transport(self.base_send),
+        )
+
+        # Wire protocol from Sec-WebSocket-Protocol (JSON unless the client
+        # asks otherwise); else echo the token subprotocol if auth used it
+        self.codec, subprotocol = negotiate_codec(self.scope.get('subprotocols'))
+        codec_opened(self.codec)
+        await self.accept(subprotocol=subprotocol or self.scope.get('auth_subprotocol'))
+        ws_connects.inc(self.endpoint)
+        ws_connections.inc(self.endpoint)
+        log_event(logger, logging.INFO, 'ws.connect.accepted', room=self.room_name, user_id=self.user.id)
+
+    def close_socket(self, close_code):
+        """Stop the outbound queue of an accepted connection and count it closed"""
+        if hasattr(self, 'outbound'):
+            self.outbound.close()
+            codec_closed(self.codec)
+            ws_connections.dec(self.endpoint)
+            ws_disconnects.inc(str(close_code))
+
+    async def join_room(self, room_id):
+        """Register presence; only the user's first session announces them"""
+        if self.per_room_metrics:
+            ws_room_connections.inc(room_id)
+        if get_presence().join(room_id, self.user, self.channel_name):
+            await get_presence().broadcast_activity(room_id, self.user.id, 'joined')
+
+    async def leave_room(self, room_id):
+        if self.per_room_metrics:
+            ws_room_connections.dec(room_id)
+        await get_typing().leave(room_id, self.user.id, self.channel_name)
+        if get_presence().leave(room_id, self.user.id, self.channel_name):
+            await get_presence().broadcast_activity(room_id, self.user.id, 'left')
+
+    async def heartbeat(self, room_id):
+        """Keep the session alive; announce the user again if it had expired"""
+        if get_presence().heartbeat(room_id, self.user, self.channel_name):
+            await get_presence().broadcast_activity(room_id, self.user.id, 'joined')
+
+    def drop_typing(self, room_id):
+        """Forget a room's typing state without broadcasting (the room is gone)"""
+        get_typing().drop(room_id, self.user.id, self.channel_name)
+
+    async def parse_frame(self, text_data, bytes_data):
+        """Check and decode an inbound frame; returns None if it was rejected"""
+        frame = text_data if text_data is not None else bytes_data
+        ws_frames_received.inc()
+        ws_bytes_received.inc(amount=payload_size(frame))
+        log_event(logger, logging.DEBUG, 'ws.message.received', room=self.room_name, user_id=self.user.id, size=len(frame))
+
+        # Size is enforced before anything is parsed
+        if len(frame) > self.limits['MAX_FRAME_SIZE']:
+            await self.reject_frame('frame_too_large', 'Frame exceeds the maximum size', close_code=1009)
+            return None
+        if text_data is None and not self.codec.binary:
+            await self.reject_frame('unsupported_frame', 'Binary frames need a binary wire protocol')
+            return None
+
+        # JSON text is accepted on every protocol
+        try:
+            if text_data is not None:
+                data = json.loads(text_data)
+            else:
+                data = self.codec.decode(bytes_data, max_size=self.limits['MAX_FRAME_SIZE'])
+        except FrameTooLarge:
+            await self.reject_frame('frame_too_large', 'Frame exceeds the maximum size', close_code=1009)
+            return None
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            await self.reject_frame('invalid_frame', 'Frames must be JSON objects')
+            return None
+        return data
+
+    async def handle_room_frame(self, room, text_data_json):
+        """Act on a frame addressed to one room the connection belongs to"""
+        message = text_data_json.get('message', '')
+
+        # Any frame counts as a heartbeat for presence
+        await self.heartbeat(room.id)
+
+        frame_type = text_data_json.get('type')
+        if frame_type == 'heartbeat':
+            return
+        if frame_type == 'active_users':
+            await self.send_frame({
+                'type': 'active_users',
+                'room_id': room.id,
+                'users': get_presence().active_users(room.id)
+            })
+            return
+        if frame_type == 'typing':
+            # Fire-and-forget: throttled per user and room, never persisted
+            if text_data_json.get('is_typing', True):
+                await get_typing().throttle(room.id, self.user, self.channel_name).typing()
+            else:
+                throttle = get_typing().get(room.id, self.user.id)
+                if throttle is not None:
+                    await throttle.stopped()
+            return
+
+        # Everything below writes to the database and may fan out
+        retry_after = await self.check_rate_limit(room)
+        if retry_after:
+            await self.reject_frame('rate_limited', 'Too many messages', retry_after=round(retry_after, 3))
+            return
+        self.violations = 0
+
+        if frame_type == 'mark_read':
+            await self.handle_mark_read(room, text_data_json.get('message_id'))
+            return
+        if frame_type == 'resume':
+            if room.id in self.resumed:
+                await self.reject_frame('already_resumed', 'This session has already resumed')
+            else:
+                await self.resume(room, text_data_json.get('last_message_id'))
+            return
+
+        if message and (not isinstance(message, str) or len(message) > self.limits['MAX_MESSAGE_LENGTH']):
+            await self.reject_frame('message_too_long', 'Message exceeds the maximum length')
+            return
+
+        if message:
+            # Save message to database, or queue it for a batched write.
+            # Queued messages have no id or timestamp yet, so with
+            # write-behind their frames carry null for both; resume is
+            # refused in that mode (check_persistence_settings).
+            if write_behind_enabled():
+                saved = await get_message_buffer().enqueue(room.id, self.user.id, message)
             else:
-                print("❌ No token found in query string")
-        
-        # Final user check
+                saved = await self.save_message(room, message)
+                if saved is None:
+                    await self.send_frame({
+                        'type': 'error',
+                        'code': 'message_not_saved',
+                        'message': 'The message could not be saved'
+                    })
+                    return
+            throttle = get_typing().get(room.id, self.user.id)
+            if throttle is not None:
+                throttle.reset()
+
+            # Broadcast to room group, serialized once for every recipient
+            await send_to_group(
+                self.channel_layer,
+                room_group_name(room.id),
+                frame_event('chat_message', self.message_frame(saved, self.user.username))
+            )
+
+    @database_sync_to_async
+    def save_message(self, room, content):
+        """Save message to database"""
+        try:
+            message = Message.objects.create(
+                room=room,
+                user=self.user,
+                content=content
+            )
+            log_event(logger, logging.DEBUG, 'ws.message.saved', room=room.id, message_id=message.id)
+            return message
+        except Exception:
+            logger.exception('ws.message.save_error', extra={'fields': {'room': room.id, 'user_id': self.user.id}})
+            return None
+
+    @staticmethod
+    def message_frame(message, username):
+        """The chat_message frame for a message; id is the client's resume cursor"""
+        return {
+            'type': 'chat_message',
+            'id': message.id,
+            'room_id': message.room_id,
+            'message': message.content,
+            'user': username,
+            'user_id': message.user_id,
+            'timestamp': message.timestamp.isoformat() if message.timestamp else None
+        }
+
+    async def resume(self, room, last_message_id):
+        """
+        Replay messages newer than last_message_id, then switch to live mode.
+
+        Missed messages go out oldest first as ``history`` frames of at most
+        BATCH_SIZE messages, each batch one range scan on the (room,
+        timestamp, id) index, and replay stops after MAX_MESSAGES. The
+        closing ``live`` frame carries the cursor to continue from and
+        ``truncated`` if the client should page the rest over REST
+        (``messages/?since_id=``). Broadcasts that arrive meanwhile are
+        delivered after it; a message saved while replaying can show up in
+        both, so clients drop ids they already have.
+        """
+        self.resumed.add(room.id)
+        conf = get_resume_settings()
+        if not conf['ENABLED']:
+            await self.send_frame({
+                'type': 'error',
+                'code': 'resume_unavailable',
+                'message': 'This server does not replay missed messages; page them over REST'
+            })
+            return
+        position = await self.get_message_position(room, last_message_id) if is_valid_id(last_message_id) else None
+        if position is None:
+            await self.send_frame({
+                'type': 'error',
+                'code': 'invalid_message_id',
+                'message': 'resume needs the id of a message in this room'
+            })
+            return
+
+        replayed = 0
+        has_more = True
+        while has_more and replayed < conf['MAX_MESSAGES']:
+            limit = min(conf['BATCH_SIZE'], conf['MAX_MESSAGES'] - replayed)
+            batch = await self.fetch_messages_after(room, position, limit + 1)
+            has_more = len(batch) > limit
+            batch = batch[:limit]
+            if not batch:
+                break
+            replayed += len(batch)
+            position = (batch[-1].timestamp, batch[-1].id)
+            self.queue_frame({
+                'type': 'history',
+                'room_id': room.id,
+                'messages': [self.message_frame(message, message.user.username) for message in batch],
+                'has_more': has_more
+            })
+
+        log_event(logger, logging.DEBUG, 'ws.resume', room=room.id, user_id=self.user.id, replayed=replayed, truncated=has_more)
+        self.queue_frame({
+            'type': 'live',
+            'room_id': room.id,
+            'last_message_id': position[1],
+            'truncated': has_more
+        })
+
+    @database_sync_to_async
+    def get_message_position(self, room, message_id):
+        return message_position(Message.objects.filter(room=room), message_id)
+
+    @database_sync_to_async
+    def fetch_messages_after(self, room, position, limit):
+        """Up to limit messages after a (timestamp, id) position, oldest first"""
+        return list(
+            Message.objects.filter(room=room)
+            .filter(newer_than(*position))
+            .select_related('user')
+            .order_by('timestamp', 'id')[:limit]
+        )
+
+    async def handle_mark_read(self, room, message_id):
+        """Advance this user's read cursor in the room and acknowledge it"""
+        if not is_valid_id(message_id) or not await self.mark_read(room, message_id):
+            await self.send_frame({
+                'type': 'error',
+                'code': 'invalid_message_id',
+                'message': 'mark_read needs the id of a message in this room'
+            })
+            return
+
+        await self.send_frame({
+            'type': 'read_marked',
+            'room_id': room.id,
+            'message_id': message_id
+        })
+
+    @database_sync_to_async
+    def mark_read(self, room, message_id):
+        """Move the read cursor forward to message_id; it never moves backwards"""
+        if not Message.objects.filter(room=room, id=message_id).exists():
+            return False
+        updated = RoomParticipant.objects.filter(
+            room=room, user=self.user, last_read_message_id__lt=message_id
+        ).update(last_read_message_id=message_id)
+        if not updated:
+            RoomParticipant.objects.get_or_create(
+                room=room, user=self.user, defaults={'last_read_message_id': message_id}
+            )
+        log_event(logger, logging.DEBUG, 'ws.mark_read', room=room.id, user_id=self.user.id, message_id=message_id)
+        return True
+
+    async def check_rate_limit(self, room=None):
+        """Take a token from the user's (and the room's) bucket; returns seconds to wait, or 0"""
+        retry_after = await get_rate_limiter('USER').hit(f'user:{self.user.id}')
+        if not retry_after and room is not None:
+            retry_after = await get_rate_limiter('ROOM').hit(f'room:{room.id}')
+        return retry_after
+
+    async def reject_frame(self, code, message, close_code=None, **extra):
+        """Send an error frame; repeated violations (or a close_code) end the connection"""
+        self.violations += 1
+        log_event(logger, logging.INFO, 'ws.frame.rejected', room=self.room_name, user_id=self.user.id, code=code)
+        await self.send_frame({'type': 'error', 'code': code, 'message': message, **extra})
+        if close_code is None and self.violations >= self.limits['MAX_VIOLATIONS']:
+            close_code = self.limits['CLOSE_CODE']
+        if close_code is not None:
+            await self.close(code=close_code)
+
+    async def send_frame(self, frame):
+        """Serialize and send a frame to this connection only"""
+        payload = self.codec.encode(frame)
+        if self.codec.binary:
+            await self.send(bytes_data=payload)
+        else:
+            await self.send(text_data=payload)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        frame = text_data if text_data is not None else bytes_data
+        if frame is not None:
+            ws_frames_sent.inc()
+            ws_bytes_sent.inc(amount=payload_size(frame))
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    def queue_frame(self, frame):
+        """Serialize a frame for this connection behind the broadcasts already queued"""
+        self.outbound.put(self.codec.encode(frame))
+
+    async def chat_message(self, event):
+        """Handle chat_message type events; the frame was serialized by the sender"""
+        log_event(logger, logging.DEBUG, 'ws.message.sent', room=self.room_name)
+        self.outbound.put(frame_payload(event['frames'], self.codec))
+
+    async def user_typing(self, event):
+        """Handle user_typing events; the typist doesn't get their own indicator"""
+        if event['user_id'] == self.user.id:
+            return
+        self.outbound.put(frame_payload(event['frames'], self.codec), key=event.get('coalesce_key'))
+
+    async def user_activity(self, event):
+        """Handle user_activity events: a user came online or went offline in the room"""
+        self.outbound.put(frame_payload(event['frames'], self.codec), key=event.get('coalesce_key'))
+
+
+class ChatConsumer(BaseChatConsumer):
+    endpoint = 'room'
+
+    async def connect(self):
+        log_event(logger, logging.DEBUG, 'ws.connect.attempt', path=self.scope.get('path'))
+
+        # Get room name from URL
+        self.room_name = self.scope['url_route']['kwargs']['room_name']
+        self.room_group_name = room_group_name(self.room_name)
+        # Resolved once by verify_room_access and reused for every write
+        self.room = None
+        self.setup_state()
+
+        # Reject connections the auth middleware could not authenticate
         if not self.user or self.user.is_anonymous:
-            print("❌ REJECTING: User is anonymous or not set")
+            log_event(logger, logging.INFO, 'ws.connect.rejected', room=self.room_name, code=4001, reason='unauthenticated')
+            ws_rejects.inc('4001')
             await self.close(code=4001)  # Custom close code for debugging
             return
 
-        print(f"✅ User authenticated: {self.user.username} (ID: {self.user.id})")
-
         # Verify room access
         has_access = await self.verify_room_access()
-        print(f"🔐 Room access: {has_access}")
-        
+
         if not has_access:
-            print("❌ REJECTING: No room access")
+            log_event(logger, logging.INFO, 'ws.connect.rejected', room=self.room_name, user_id=self.user.id, code=4002, reason='no_access')
+            ws_rejects.inc('4002')
             await self.close(code=4002)  # Custom close code for no access
             return
 
+        # Broadcasts address the room by id, however the URL spelled it
+        self.room_group_name = room_group_name(self.room.id)
+
         # Join room group
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
 
-        await self.accept()
-        print("✅✅✅ WebSocket connection ACCEPTED ✅✅✅")
+        await self.open_socket()
+
+        self.presence_room_id = self.room.id
+        await self.join_room(self.presence_room_id)
 
         # Send welcome message
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'connection_established',
             'message': f'Successfully connected to room: {self.room_name}',
             'user': self.user.username,
             'user_id': self.user.id
-        }))
+        })
 
-    @database_sync_to_async
-    def get_user_from_token(self, token):
-        """Get user from JWT token"""
-        try:
-            from rest_framework_simplejwt.tokens import AccessToken
-            print(f"🔐 Validating token: {token[:50]}...")
-            access_token = AccessToken(token)
-            user_id = access_token['user_id']
-            print(f"🔐 Token validated, user_id: {user_id}")
-            user = User.objects.get(id=user_id)
-            print(f"🔐 User found: {user.username}")
-            return user
-        except Exception as e:
-            print(f"❌ Token validation failed: {str(e)}")
-            return None
+        # Reconnecting clients pass the last message they saw
+        last_message_id = parse_qs(self.scope.get('query_string', b'').decode()).get('last_message_id')
+        if last_message_id:
+            await self.resume(self.room, parse_id(last_message_id[-1]))
 
     @database_sync_to_async
     def verify_room_access(self):
         """Verify user has access to this room"""
         try:
-            print(f"🔐 Checking room access for user {self.user.id} in room {self.room_name}")
             room = ChatRoom.objects.get(id=int(self.room_name))
             has_access = room.participants.filter(id=self.user.id).exists()
-            print(f"🔐 Room '{room.name}' access: {has_access}")
+            if has_access:
+                self.room = room
             return has_access
-        except ChatRoom.DoesNotExist:
-            print(f"❌ Room {self.room_name} does not exist")
+        except (ChatRoom.DoesNotExist, ValueError):
             return False
-        except Exception as e:
-            print(f"❌ Room access error: {str(e)}")
+        except Exception:
+            logger.exception('ws.room_access.error', extra={'fields': {'room': self.room_name}})
             return False
 
     async def disconnect(self, close_code):
-        print(f"🔌 WebSocket DISCONNECTED with code: {close_code}")
+        log_event(logger, logging.INFO, 'ws.disconnect', room=getattr(self, 'room_name', None), code=close_code)
+        self.close_socket(close_code)
+        if getattr(self, 'presence_room_id', None) is not None:
+            await self.leave_room(self.presence_room_id)
         if hasattr(self, 'room_group_name') and hasattr(self, 'channel_layer'):
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
             )
 
-    async def receive(self, text_data):
-        print(f"📥 Received message: {text_data}")
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            text_data_json = json.loads(text_data)
-            message = text_data_json.get('message', '')
-            
-            if message:
-                # Save message to database
-                await self.save_message(message)
-                
-                # Broadcast to room group
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'chat_message',
-                        'message': message,
-                        'user': self.user.username,
-                        'user_id': self.user.id
-                    }
-                )
-        except Exception as e:
-            print(f"❌ Error receiving message: {str(e)}")
+            text_data_json = await self.parse_frame(text_data, bytes_data)
 
-    @database_sync_to_async
-    def save_message(self, content):
-        """Save message to database"""
+            # Rejected, or access was revoked since connect
+            if text_data_json is None or self.room is None:
+                return
+
+            await self.handle_room_frame(self.room, text_data_json)
+        except Exception:
+            logger.exception('ws.receive.error', extra={'fields': {'room': self.room_name, 'user_id': self.user.id}})
+
+    async def room_deleted(self, event):
+        """Handle room_deleted events: forget the room and disconnect"""
+        log_event(logger, logging.INFO, 'ws.room_deleted', room=self.room_name, user_id=self.user.id)
+        self.room = None
+        self.drop_typing(self.presence_room_id)
+        await self.close(code=4002)
+
+    async def participants_removed(self, event):
+        """Handle participants_removed events: disconnect if this user lost access"""
+        user_ids = event.get('user_ids')
+        if user_ids is None or self.user.id in user_ids:
+            log_event(logger, logging.INFO, 'ws.access_revoked', room=self.room_name, user_id=self.user.id)
+            self.room = None
+            self.drop_typing(self.presence_room_id)
+            await self.close(code=4002)
+
+
+class MultiplexChatConsumer(BaseChatConsumer):
+    """
+    One connection for many rooms (``ws/chat/``).
+
+    Clients send ``{"type": "subscribe", "room_ids": [...]}`` (or a single
+    ``room_id``) and ``unsubscribe`` likewise; access to all requested rooms
+    is checked in one query. Every other frame names its room with
+    ``room_id`` and behaves as on ``ws/chat/<room_id>/``, and every frame
+    the server sends carries the ``room_id`` it belongs to. At most
+    CHAT_MULTIPLEX['MAX_ROOMS'] rooms can be subscribed at once.
+    """
+
+    endpoint = 'multiplex'
+
+    async def connect(self):
+        log_event(logger, logging.DEBUG, 'ws.connect.attempt', path=self.scope.get('path'))
+        self.room_name = None
+        self.rooms = {}  # room_id -> ChatRoom
+        self.setup_state()
+
+        if not self.user or self.user.is_anonymous:
+            log_event(logger, logging.INFO, 'ws.connect.rejected', code=4001, reason='unauthenticated')
+            ws_rejects.inc('4001')
+            await self.close(code=4001)
+            return
+
+        await self.open_socket()
+        await self.send_frame({
+            'type': 'connection_established',
+            'message': 'Successfully connected',
+            'user': self.user.username,
+            'user_id': self.user.id
+        })
+
+    async def disconnect(self, close_code):
+        log_event(logger, logging.INFO, 'ws.disconnect', rooms=len(getattr(self, 'rooms', ())), code=close_code)
+        self.close_socket(close_code)
+        for room_id in list(getattr(self, 'rooms', ())):
+            await self.unsubscribe_room(room_id)
+
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            room = ChatRoom.objects.get(id=int(self.room_name))
-            message = Message.objects.create(
-                room=room,
-                user=self.user,
-                content=content
-            )
-            print(f"💾 Saved message: '{content}' by {self.user.username}")
-            return message
-        except Exception as e:
-            print(f"❌ Error saving message: {str(e)}")
+            text_data_json = await self.parse_frame(text_data, bytes_data)
+            if text_data_json is None:
+                return
+
+            frame_type = text_data_json.get('type')
+            if frame_type in ('subscribe', 'unsubscribe'):
+                room_ids = self.frame_room_ids(text_data_json)
+                if room_ids is None:
+                    await self.reject_frame('invalid_room_id', f'{frame_type} needs room_id or a list of room_ids')
+                elif frame_type == 'subscribe':
+                    await self.subscribe(room_ids)
+                else:
+                    for room_id in room_ids:
+                        if room_id in self.rooms:
+                            await self.unsubscribe_room(room_id)
+                    await self.send_frame({'type': 'unsubscribed', 'room_ids': room_ids})
+                return
+
+            if frame_type == 'heartbeat' and 'room_id' not in text_data_json:
+                for room_id in self.rooms:
+                    await self.heartbeat(room_id)
+                return
+
+            room_id = text_data_json.get('room_id')
+            if not is_valid_id(room_id):
+                await self.reject_frame('invalid_room_id', f'{frame_type} needs the id of a subscribed room')
+                return
+            room = self.rooms.get(room_id)
+            if room is None:
+                await self.reject_frame('not_subscribed', 'Subscribe to the room first', room_id=room_id)
+                return
+            await self.handle_room_frame(room, text_data_json)
+        except Exception:
+            logger.exception('ws.receive.error', extra={'fields': {'user_id': self.user.id}})
+
+    @staticmethod
+    def frame_room_ids(frame):
+        room_ids = frame.get('room_ids')
+        if room_ids is None and 'room_id' in frame:
+            room_ids = [frame['room_id']]
+        if not isinstance(room_ids, list) or not all(is_valid_id(room_id) for room_id in room_ids):
             return None
+        return list(dict.fromkeys(room_ids))
 
-    async def chat_message(self, event):
-        """Handle chat_message type events"""
-        print(f"📤 Broadcasting message: {event['user']}: {event['message']}")
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': event['message'],
-            'user': event['user'],
-            'user_id': event['user_id']
-        }))
\ No newline at end of file
+    async def subscribe(self, room_ids):
+        new_ids = [room_id for room_id in room_ids if room_id not in self.rooms]
+        if len(self.rooms) + len(new_ids) > get_multiplex_settings()['MAX_ROOMS']:
+            await self.reject_frame('too_many_rooms', 'Subscription limit reached')
+            return
+
+        # Subscribing costs a query, so it shares the user's message budget
+        retry_after = await self.check_rate_limit()
+        if retry_after:
+            await self.reject_frame('rate_limited', 'Too many messages', retry_after=round(retry_after, 3))
+            return
+
+        rooms = await self.accessible_rooms(new_ids) if new_ids else {}
+        for room_id, room in rooms.items():
+            self.rooms[room_id] = room
+            await self.channel_layer.group_add(room_group_name(room_id), self.channel_name)
+            await self.join_room(room_id)
+        log_event(logger, logging.DEBUG, 'ws.subscribe', user_id=self.user.id, rooms=len(rooms))
+        await self.send_frame({
+            'type': 'subscribed',
+            'room_ids': [room_id for room_id in room_ids if room_id in self.rooms],
+            'denied': [room_id for room_id in room_ids if room_id not in self.rooms],
+        })
+
+    @database_sync_to_async
+    def accessible_rooms(self, room_ids):
+        """The rooms among room_ids this user belongs to, in one query"""
+        return {room.id: room for room in ChatRoom.objects.filter(id__in=room_ids, participants=self.user)}
+
+    async def unsubscribe_room(self, room_id):
+        self.rooms.pop(room_id, None)
+        self.resumed.discard(room_id)
+        await self.leave_room(room_id)
+        await self.channel_layer.group_discard(room_group_name(room_id), self.channel_name)
+
+    async def revoke(self, room_id):
+        if room_id in self.rooms:
+            log_event(logger, logging.INFO, 'ws.access_revoked', room=room_id, user_id=self.user.id)
+            self.drop_typing(room_id)
+            await self.unsubscribe_room(room_id)
+            self.queue_frame({'type': 'unsubscribed', 'room_ids': [room_id], 'reason': 'revoked'})
+
+    async def room_deleted(self, event):
+        """Handle room_deleted events: drop the subscription"""
+        await self.revoke(event['room_id'])
+
+    async def participants_removed(self, event):
+        """Handle participants_removed events: drop the subscription if this user lost access"""
+        user_ids = event.get('user_ids')
+        if user_ids is None or self.user.id in user_ids:
+            await self.revoke(event['room_id'])
@@ -0,0 +1,71 @@
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .metrics import db_call_seconds
+
+_executor = None
+_journal_mode_checked = set()  # SQLite databases whose journal mode is set
+
+
+def get_db_executor():
+    """Return the pool for WebSocket database work, or None to use channels' single thread"""
+    global _executor
+    threads = getattr(settings, 'CHAT_DB_THREADS', 0)
+    if _executor is None and threads:
+        _executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='chat-db')
+    return _executor
+
+
+def database_sync_to_async(func):
+    """
+    Drop-in for channels' ``database_sync_to_async``.
+
+    Channels runs every call thread-sensitively, and consumers don't open a
+    thread-sensitive context, so all database work of all connections in a
+    process queues on one thread. With CHAT_DB_THREADS set, calls run on a
+    pool of that many threads instead, each keeping its own persistent
+    connection (CONN_MAX_AGE); stale connections are still closed around
+    every call. The time each call spends on its thread is recorded in
+    ``chat_db_call_seconds``.
+    """
+    func = timed(func)
+    executor = get_db_executor()
+    if executor is None:
+        return DatabaseSyncToAsync(func)
+    return DatabaseSyncToAsync(func, thread_sensitive=False, executor=executor)
+
+
+def timed(func):
+    name = getattr(func, '__qualname__', repr(func))
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            db_call_seconds.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        # Persistent in the database file: once per database and process
+        journal_mode = getattr(settings, 'CHAT_SQLITE_JOURNAL_MODE', '')
+        name = connection.settings_dict['NAME']
+        if journal_mode and name not in _journal_mode_checked:
+            cursor.execute('PRAGMA journal_mode')
+            if cursor.fetchone()[0].lower() != journal_mode.lower():
+                cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+            _journal_mode_checked.add(name)
+        for pragma, value in getattr(settings, 'CHAT_SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
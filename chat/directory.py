@@ -0,0 +1,83 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.db.models.functions import Collate, Lower
+
+from .models import ChatRoom
+
+DIRECTORY_FIELDS = ('id', 'username', 'first_name', 'last_name')
+PREFIX_FIELDS = ('username', 'first_name', 'last_name')
+RECENT_ROOMS = 20
+
+
+def prefix_key(field):
+    """
+    The indexed expression prefix searches compare against (migration 0009).
+
+    Lowercased, and in byte order on Postgres so a prefix is one contiguous
+    range of the index whatever the database collation; SQLite compares
+    bytes already (but its lower() only folds ASCII letters).
+    """
+    key = Lower(field)
+    if connection.vendor == 'postgresql':
+        key = Collate(key, 'C')
+    return key
+
+
+def prefix_filter(prefix):
+    """Q matching users whose username, first or last name starts with prefix"""
+    prefix = prefix.lower()
+    upper = prefix[:-1] + chr(min(ord(prefix[-1]) + 1, 0x10FFFF))
+    condition = Q()
+    for field in PREFIX_FIELDS:
+        condition |= Q(**{f'{field}_key__gte': prefix, f'{field}_key__lt': upper})
+    return condition
+
+
+def directory_queryset(user, prefix=None):
+    queryset = User.objects.filter(is_active=True).exclude(id=user.id).only(*DIRECTORY_FIELDS)
+    if prefix:
+        queryset = queryset.alias(**{f'{field}_key': prefix_key(field) for field in PREFIX_FIELDS})
+        queryset = queryset.filter(prefix_filter(prefix))
+    return queryset
+
+
+def search_directory(user, prefix=None, after=None, limit=20):
+    """
+    One page of other active users ordered by username.
+
+    ``after`` is the last username of the previous page, so every page is a
+    range read of the username index rather than an OFFSET; returns
+    ``(users, has_more)``.
+    """
+    queryset = directory_queryset(user, prefix)
+    if after:
+        queryset = queryset.filter(username__gt=after)
+    users = list(queryset.order_by('username')[:limit + 1])
+    return users[:limit], len(users) > limit
+
+
+def recent_contacts(user, prefix=None, limit=10):
+    """
+    The other members of user's RECENT_ROOMS most recently active private
+    chats, most recent first.
+
+    Group rooms are left out: collecting their members would cost as much
+    as the largest room, and their members are in the directory anyway.
+    """
+    # Three small queries, each bounded by RECENT_ROOMS, so the planner
+    # never starts from auth_user or its prefix indexes
+    rooms = dict(
+        ChatRoom.objects.filter(participants=user, chat_type='private')
+        .order_by('-last_activity_at')
+        .values_list('id', 'last_activity_at')[:RECENT_ROOMS]
+    )
+    last_activity = {}
+    memberships = ChatRoom.participants.through.objects.filter(chatroom_id__in=rooms).exclude(user=user)
+    for user_id, room_id in memberships.values_list('user_id', 'chatroom_id'):
+        last_activity[user_id] = max(last_activity.get(user_id, rooms[room_id]), rooms[room_id])
+    if not last_activity:
+        return []
+    users = list(directory_queryset(user, prefix).filter(id__in=last_activity).order_by('username'))
+    users.sort(key=lambda contact: last_activity[contact.id], reverse=True)
+    return users[:limit]
@@ -0,0 +1,219 @@
+import json
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import orjson
+except ImportError:  # optional fast encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional binary wire protocol
+    msgpack = None
+
+
+def _json_dumps(data):
+    return json.dumps(data, separators=(',', ':'), default=str)
+
+
+def _orjson_dumps(data):
+    return orjson.dumps(data, default=str).decode()
+
+
+def get_json_encoder(name='auto'):
+    """
+    Return a function serializing a frame to JSON text.
+
+    ``auto`` picks orjson when it is installed and falls back to the standard
+    library; ``orjson`` and ``json`` force one or the other.
+    """
+    if name == 'json' or (name == 'auto' and orjson is None):
+        return _json_dumps
+    if name in ('auto', 'orjson'):
+        if orjson is None:
+            raise ImproperlyConfigured('CHAT_JSON_ENCODER is "orjson" but orjson is not installed')
+        return _orjson_dumps
+    raise ImproperlyConfigured(f'Unknown CHAT_JSON_ENCODER "{name}"')
+
+
+_dumps = None
+
+
+def dumps(data):
+    """Serialize a frame with the encoder chosen by CHAT_JSON_ENCODER"""
+    global _dumps
+    if _dumps is None:
+        _dumps = get_json_encoder(getattr(settings, 'CHAT_JSON_ENCODER', 'auto'))
+    return _dumps(data)
+
+
+# Short keys used by the compact binary protocol. Every frame key is mapped
+# on the way out and mapped back for frames the client sends; unknown keys
+# pass through unchanged.
+COMPACT_KEYS = {
+    'type': 't',
+    'message': 'm',
+    'user': 'u',
+    'user_id': 'ui',
+    'users': 'us',
+    'room_id': 'r',
+    'id': 'id',
+    'message_id': 'mi',
+    'messages': 'ms',
+    'last_message_id': 'lm',
+    'has_more': 'hm',
+    'timestamp': 'ts',
+    'is_typing': 'ty',
+    'action': 'a',
+    'code': 'c',
+    'retry_after': 'ra',
+}
+EXPANDED_KEYS = {short: key for key, short in COMPACT_KEYS.items()}
+
+RAW = b'\x00'
+DEFLATED = b'\x01'
+
+
+class FrameTooLarge(ValueError):
+    """A compressed frame inflates past the size limit"""
+
+
+def _rename_keys(obj, mapping):
+    if isinstance(obj, dict):
+        return {mapping.get(key, key): _rename_keys(value, mapping) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_rename_keys(value, mapping) for value in obj]
+    return obj
+
+
+class JSONCodec:
+    """The default protocol: JSON text frames"""
+
+    name = 'json'
+    subprotocol = 'chat.json'
+    binary = False
+
+    def encode(self, frame):
+        return dumps(frame)
+
+    def decode(self, payload, max_size=None):
+        return json.loads(payload)
+
+
+class MsgpackCodec:
+    """
+    Compact binary protocol: MessagePack frames with short keys.
+
+    With ``compress`` every frame starts with one flag byte: 0x00 for a plain
+    MessagePack body, 0x01 for a raw-deflate compressed one. Only frames of at
+    least ``min_size`` bytes are compressed, since small frames grow. Inbound
+    frames are inflated to at most ``max_size`` bytes, so a small compressed
+    frame can't expand past the limit its uncompressed form would hit.
+    """
+
+    binary = True
+
+    def __init__(self, compress=False, min_size=512, level=6):
+        self.compress = compress
+        self.min_size = min_size
+        self.level = level
+        self.name = 'msgpack.deflate' if compress else 'msgpack'
+        self.subprotocol = f'chat.{self.name}'
+
+    def encode(self, frame):
+        body = msgpack.packb(_rename_keys(frame, COMPACT_KEYS), default=str)
+        if not self.compress:
+            return body
+        if len(body) < self.min_size:
+            return RAW + body
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        return DEFLATED + compressor.compress(body) + compressor.flush()
+
+    def decode(self, payload, max_size=None):
+        if self.compress:
+            flag, payload = payload[:1], payload[1:]
+            if flag == DEFLATED:
+                payload = self.inflate(payload, max_size)
+        return _rename_keys(msgpack.unpackb(payload), EXPANDED_KEYS)
+
+    @staticmethod
+    def inflate(payload, max_size=None):
+        decompressor = zlib.decompressobj(-15)
+        try:
+            body = decompressor.decompress(payload, max_size or 0)
+        except zlib.error as exc:
+            raise ValueError(f'Invalid deflate stream: {exc}')
+        # Output cut at max_size leaves input (or buffered output) behind
+        if decompressor.unconsumed_tail or (max_size and len(body) >= max_size and not decompressor.eof):
+            raise FrameTooLarge(f'Frame inflates past {max_size} bytes')
+        return body
+
+
+_codecs = None
+
+
+def get_codecs():
+    """Codecs enabled by CHAT_WIRE_PROTOCOLS, keyed by name; JSON is always available"""
+    global _codecs
+    if _codecs is None:
+        enabled = getattr(settings, 'CHAT_WIRE_PROTOCOLS', ['chat.json'])
+        compression = getattr(settings, 'CHAT_WIRE_COMPRESSION', {})
+        candidates = [JSONCodec()]
+        if msgpack is not None:
+            candidates.append(MsgpackCodec())
+            candidates.append(MsgpackCodec(
+                compress=True,
+                min_size=compression.get('MIN_SIZE', 512),
+                level=compression.get('LEVEL', 6),
+            ))
+        _codecs = {
+            codec.name: codec for codec in candidates
+            if codec.name == 'json' or codec.subprotocol in enabled
+        }
+    return _codecs
+
+
+def negotiate_codec(subprotocols):
+    """Pick the first codec the client offered; returns (codec, subprotocol or None)"""
+    by_subprotocol = {codec.subprotocol: codec for codec in get_codecs().values()}
+    for subprotocol in subprotocols or []:
+        if subprotocol in by_subprotocol:
+            return by_subprotocol[subprotocol], subprotocol
+    return get_codecs()['json'], None
+
+
+_connections = {}  # codec name -> open connections in this process
+
+
+def codec_opened(codec):
+    _connections[codec.name] = _connections.get(codec.name, 0) + 1
+
+
+def codec_closed(codec):
+    _connections[codec.name] -= 1
+
+
+def encode_all(frame):
+    """
+    Encode a frame for fan-out: as JSON, plus once per other codec that has
+    a connection in this process.
+
+    Codecs nobody here uses cost nothing, neither CPU nor channel-layer
+    bytes. A connection on another worker whose codec was skipped gets its
+    payload from ``frame_payload``.
+    """
+    return {
+        name: codec.encode(frame) for name, codec in get_codecs().items()
+        if name == 'json' or _connections.get(name)
+    }
+
+
+def frame_payload(frames, codec):
+    """A connection's payload from an ``encode_all`` result, encoded from the JSON one if missing"""
+    payload = frames.get(codec.name)
+    if payload is None:
+        payload = codec.encode(json.loads(frames['json']))
+    return payload
@@ -0,0 +1,30 @@
+import time
+
+from .encoding import encode_all
+from .metrics import group_send_seconds
+
+
+def room_group_name(room_id):
+    """Channel-layer group shared by every connection to a room"""
+    return f'chat_{room_id}'
+
+
+def frame_event(handler, frame, **extra):
+    """
+    Build a channel-layer event carrying a frame serialized once by the sender.
+
+    ``handler`` names the consumer method that receives the event; it
+    forwards ``event['frames'][<its codec>]`` to its socket unchanged, so a
+    room of N members costs one serialization per wire protocol in use
+    instead of N.
+    """
+    return {'type': handler, 'frames': encode_all(frame), **extra}
+
+
+async def send_to_group(channel_layer, group, event):
+    """``channel_layer.group_send``, timed into ``chat_group_send_seconds``"""
+    started = time.perf_counter()
+    try:
+        await channel_layer.group_send(group, event)
+    finally:
+        group_send_seconds.observe(time.perf_counter() - started, event['type'])
@@ -0,0 +1,210 @@
+import asyncio
+import time
+import uuid
+from collections import deque
+from copy import deepcopy
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from .metrics import register_stats
+
+
+class LocalChannel:
+    __slots__ = ('messages', 'waiters', 'capacity')
+
+    def __init__(self, capacity):
+        self.messages = deque()  # (expires_at, message), oldest first
+        self.waiters = deque()  # futures of pending receive() calls
+        self.capacity = capacity
+
+
+class LocalChannelLayer(BaseChannelLayer):
+    """
+    Channel layer for a single process: no Redis, no network round trip.
+
+    Behaves like the Redis layer towards consumers: messages expire after
+    ``expiry`` seconds, a channel holding an expired message is treated as
+    dead and leaves its groups, group memberships lapse after
+    ``group_expiry`` seconds, ``send`` raises ChannelFull past a channel's
+    capacity and ``group_send`` skips full channels. Unlike the stock
+    InMemoryChannelLayer it does not scan every channel and group on each
+    send: groups keep members in join order and a channel -> groups index
+    makes removals O(groups joined), expired entries are swept at most
+    every ``sweep_interval`` seconds, and a group message is copied once,
+    with each member getting its own top-level dict (nested values are
+    shared and must be treated as read-only).
+
+    Only connections served by this process can talk to each other, so use
+    it for single-node deployments and tests.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, sweep_interval=1.0, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.group_expiry = group_expiry
+        self.sweep_interval = sweep_interval
+
+        self.channels = {}  # channel -> LocalChannel
+        self.groups = {}  # group -> {channel: joined_at}, oldest first
+        self.memberships = {}  # channel -> set of groups
+        self._next_sweep = 0.0
+
+        # Counters
+        self.delivered = 0
+        self.dropped = 0
+        self.expired = 0
+        register_stats('chat_channel_layer', self.stats, 'In-process channel layer')
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        """Send a message onto a channel; raises ChannelFull if it is at capacity"""
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        assert '__asgi_channel__' not in message
+
+        now = time.monotonic()
+        self._maybe_sweep(now)
+        if not self._put(channel, deepcopy(message), now):
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        """Wait for the next message on a channel"""
+        assert self.valid_channel_name(channel)
+        self._maybe_sweep(time.monotonic())
+
+        while True:
+            queue = self._channel(channel)
+            if queue.messages:
+                _, message = queue.messages.popleft()
+                if not queue.messages and not queue.waiters:
+                    self.channels.pop(channel, None)
+                return message
+
+            waiter = asyncio.get_running_loop().create_future()
+            queue.waiters.append(waiter)
+            try:
+                await waiter
+            finally:
+                try:
+                    queue.waiters.remove(waiter)
+                except ValueError:
+                    pass
+                if not queue.messages and not queue.waiters and self.channels.get(channel) is queue:
+                    del self.channels[channel]
+
+    async def new_channel(self, prefix='specific.'):
+        return f'{prefix}.local!{uuid.uuid4().hex}'
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        members = self.groups.setdefault(group, {})
+        # Re-adding refreshes the membership and moves it to the back
+        members.pop(channel, None)
+        members[channel] = time.monotonic()
+        self.memberships.setdefault(channel, set()).add(group)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), 'Invalid channel name'
+        assert self.valid_group_name(group), 'Invalid group name'
+        self._discard(group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Invalid group name'
+
+        now = time.monotonic()
+        self._maybe_sweep(now)
+        members = self.groups.get(group)
+        if not members:
+            return
+        message = deepcopy(message)
+        for channel in list(members):
+            if not self._put(channel, dict(message), now):
+                self.dropped += 1
+
+    # Flush extension
+
+    async def flush(self):
+        self.channels = {}
+        self.groups = {}
+        self.memberships = {}
+
+    async def close(self):
+        pass
+
+    # Internals
+
+    def _channel(self, channel):
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = LocalChannel(self.get_capacity(channel))
+        return queue
+
+    def _put(self, channel, message, now):
+        queue = self._channel(channel)
+        if len(queue.messages) >= queue.capacity:
+            return False
+        queue.messages.append((now + self.expiry, message))
+        self.delivered += 1
+        for waiter in queue.waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+        return True
+
+    def _discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+        groups = self.memberships.get(channel)
+        if groups is not None:
+            groups.discard(group)
+            if not groups:
+                del self.memberships[channel]
+
+    def _maybe_sweep(self, now):
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.sweep_interval
+            self._sweep(now)
+
+    def _sweep(self, now):
+        # Undelivered messages past their expiry mean nobody reads the channel
+        for channel, queue in list(self.channels.items()):
+            if queue.messages and queue.messages[0][0] < now:
+                while queue.messages and queue.messages[0][0] < now:
+                    queue.messages.popleft()
+                    self.expired += 1
+                for group in list(self.memberships.get(channel, ())):
+                    self._discard(group, channel)
+                if not queue.messages and not queue.waiters:
+                    del self.channels[channel]
+
+        # Members are in join order, so stop at the first one still valid
+        deadline = now - self.group_expiry
+        for group, members in list(self.groups.items()):
+            lapsed = []
+            for channel, joined_at in members.items():
+                if joined_at >= deadline:
+                    break
+                lapsed.append(channel)
+            for channel in lapsed:
+                self._discard(group, channel)
+
+    def stats(self):
+        return {
+            'channels': len(self.channels),
+            'groups': len(self.groups),
+            'memberships': sum(len(members) for members in self.groups.values()),
+            'pending': sum(len(queue.messages) for queue in self.channels.values()),
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'expired': self.expired,
+        }
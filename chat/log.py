@@ -0,0 +1,116 @@
+"""
+Structured logging helpers for the chat app.
+
+Everything here is wired up from ``LOGGING`` in ``chat_app/settings.py``:
+records are emitted as one JSON object per line, debug chatter is sampled per
+event, and the handler only enqueues records so the event loop never waits
+on log I/O. Formatting and writing happen on a background listener thread.
+"""
+import atexit
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from .metrics import register_stats
+
+
+def log_event(logger, level, event, **fields):
+    """Log a structured event; fields are only collected if the level is enabled"""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'fields': fields})
+
+
+class StructuredFormatter(logging.Formatter):
+    """Format records as a single JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            entry['suppressed'] = suppressed
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SampledFilter(logging.Filter):
+    """
+    Rate-limit low-level records per event name.
+
+    At most ``rate`` records per ``per`` seconds are let through for each
+    event at or below ``level``; the number dropped in between is attached to
+    the next record that passes as ``suppressed``. Higher levels always pass.
+    """
+
+    def __init__(self, level='DEBUG', rate=20, per=1.0):
+        super().__init__()
+        self.level = level if isinstance(level, int) else logging.getLevelName(level)
+        self.rate = rate
+        self.per = per
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno > self.level:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            started, count, suppressed = self._windows.get(record.msg, (now, 0, 0))
+            if now - started >= self.per:
+                started, count = now, 0
+            if count >= self.rate:
+                self._windows[record.msg] = (started, count, suppressed + 1)
+                return False
+            self._windows[record.msg] = (started, count + 1, 0)
+
+        record.suppressed = suppressed
+        return True
+
+
+class QueueingStreamHandler(QueueHandler):
+    """
+    Non-blocking stream handler.
+
+    ``emit`` only puts the record on a bounded queue; a listener thread
+    formats and writes it. When the queue is full the record is dropped and
+    counted in ``dropped`` rather than blocking the caller.
+    """
+
+    def __init__(self, stream=None, max_queue_size=10000):
+        super().__init__(queue.Queue(max_queue_size))
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.dropped = 0
+        register_stats('chat_log', self.stats, 'Queueing log handler')
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def stats(self):
+        return {'queue_depth': self.queue.qsize(), 'dropped': self.dropped}
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
@@ -0,0 +1,233 @@
+"""
+Process metrics for the chat app, exported in the Prometheus text format.
+
+Recording is cheap enough to leave on: every metric keeps one private dict
+per thread, so an increment or observation is a thread-local lookup and a
+dict update, with no lock and no contention between the event loop and the
+database threads. Shards are only summed when the endpoint is scraped.
+Components that already keep their own counters (outbound queues, write
+buffer, token cache, presence, channel layer, log handler) register their
+``stats()`` with ``register_stats`` and are exported alongside.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+METRICS_DEFAULTS = {
+    'PER_ROOM': True,
+    'TOKEN': None,
+}
+
+# Seconds; fine-grained at the low end where in-process work lands
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry = []
+_stats = {}  # prefix -> (stats callable, documentation)
+
+
+def get_metrics_settings():
+    return {**METRICS_DEFAULTS, **getattr(settings, 'CHAT_METRICS', {})}
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        _registry.append(self)
+
+    def shard(self):
+        """This thread's dict of label values -> value; only this thread writes to it"""
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def collect(self):
+        """Label values -> value, summed over every thread's shard"""
+        merged = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            # dict.copy() runs under the GIL, so the owner can't resize it mid-copy
+            for labels, value in shard.copy().items():
+                merged[labels] = merged.get(labels, 0) + value
+        return merged
+
+    def samples(self):
+        merged = self.collect()
+        if not merged and not self.labelnames:
+            merged = {(): 0}
+        for labels, value in sorted(merged.items()):
+            yield self.name, self.label_pairs(labels), value
+
+    def label_pairs(self, labels):
+        return list(zip(self.labelnames, labels))
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self.shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down; label sets that return to zero are dropped"""
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        shard = self.shard()
+        value = shard.get(labels, 0) + amount
+        if value or not labels:
+            shard[labels] = value
+        else:
+            shard.pop(labels, None)
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self):
+        for name, labels, value in super().samples():
+            if value or not labels:
+                yield name, labels, value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self.shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # Per-bucket (not cumulative) counts, the last one for +Inf, then the sum
+            entry = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-1] += value
+
+    def collect(self):
+        merged = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for labels, entry in shard.copy().items():
+                entry = list(entry)
+                total = merged.get(labels)
+                merged[labels] = entry if total is None else [a + b for a, b in zip(total, entry)]
+        return merged
+
+    def samples(self):
+        for labels, entry in sorted(self.collect().items()):
+            pairs = self.label_pairs(labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry):
+                cumulative += count
+                yield f'{self.name}_bucket', pairs + [('le', format_value(bound))], cumulative
+            yield f'{self.name}_sum', pairs, entry[-1]
+            yield f'{self.name}_count', pairs, cumulative
+
+    def time(self, *labels):
+        return Timer(self, labels)
+
+
+class Timer:
+    """Context manager observing the seconds spent inside it"""
+
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+def register_stats(prefix, stats, documentation):
+    """Export a component's ``stats()`` dict as ``<prefix>_<key>`` on every scrape"""
+    _stats[prefix] = (stats, documentation)
+
+
+def format_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    if value == float('inf'):
+        return '+Inf'
+    if value == float('-inf'):
+        return '-Inf'
+    return repr(float(value))
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_sample(name, labels, value):
+    if labels:
+        name += '{' + ','.join(f'{key}="{escape(label)}"' for key, label in labels) + '}'
+    return f'{name} {format_value(value)}'
+
+
+def render():
+    """Every registered metric and component stats in the Prometheus text format"""
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(format_sample(*sample) for sample in metric.samples())
+    for prefix, (stats, documentation) in sorted(_stats.items()):
+        for key, value in stats().items():
+            if not isinstance(value, (int, float)):
+                continue
+            name = f'{prefix}_{key}'
+            lines.append(f'# HELP {name} {documentation}: {key.replace("_", " ")}')
+            lines.append(f'# TYPE {name} untyped')
+            lines.append(format_sample(name, (), value))
+    return '\n'.join(lines) + '\n'
+
+
+def payload_size(frame):
+    """Size in bytes of a text or binary WebSocket frame"""
+    if isinstance(frame, str) and not frame.isascii():
+        return len(frame.encode())
+    return len(frame)
+
+
+# WebSocket connections
+ws_connections = Gauge('chat_ws_connections', 'Open WebSocket connections', ['endpoint'])
+ws_room_connections = Gauge('chat_ws_room_connections', 'Open WebSocket connections joined to a room', ['room'])
+ws_connects = Counter('chat_ws_connects_total', 'Accepted WebSocket connections', ['endpoint'])
+ws_rejects = Counter('chat_ws_rejects_total', 'WebSocket connections refused at connect, by close code', ['code'])
+ws_disconnects = Counter('chat_ws_disconnects_total', 'Closed WebSocket connections, by close code', ['code'])
+
+# Frames and bytes on the wire
+ws_frames_received = Counter('chat_ws_frames_received_total', 'WebSocket frames received from clients')
+ws_bytes_received = Counter('chat_ws_received_bytes_total', 'WebSocket payload bytes received from clients')
+ws_frames_sent = Counter('chat_ws_frames_sent_total', 'WebSocket frames sent to clients')
+ws_bytes_sent = Counter('chat_ws_sent_bytes_total', 'WebSocket payload bytes sent to clients')
+
+# Latency
+group_send_seconds = Histogram('chat_group_send_seconds', 'Channel layer group_send latency, by event', ['event'])
+db_call_seconds = Histogram('chat_db_call_seconds', 'Time spent running database_sync_to_async calls, by function', ['function'])
@@ -0,0 +1,57 @@
+from urllib.parse import parse_qs
+
+from channels.auth import AuthMiddlewareStack
+from django.contrib.auth.models import AnonymousUser
+
+from .auth import get_user_from_token
+
+# Browsers cannot set headers on WebSocket requests, so clients may instead
+# offer the subprotocols ["access_token", "<jwt>"]; the server then has to
+# select "access_token" when accepting the connection.
+TOKEN_SUBPROTOCOL = 'access_token'
+
+
+def get_token_from_scope(scope):
+    """Return (token, subprotocol) from the query string or Sec-WebSocket-Protocol"""
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if query.get('token'):
+        return query['token'][0], None
+
+    subprotocols = scope.get('subprotocols') or []
+    if TOKEN_SUBPROTOCOL in subprotocols:
+        index = subprotocols.index(TOKEN_SUBPROTOCOL)
+        if index + 1 < len(subprotocols):
+            return subprotocols[index + 1], TOKEN_SUBPROTOCOL
+    return None, None
+
+
+class JWTAuthMiddleware:
+    """
+    Authenticate WebSocket connections from a JWT access token.
+
+    The token signature and expiry are checked without touching the database
+    and the user comes from the process-wide token user cache. The user is
+    resolved before the consumer runs (a query only on a cache miss): a lazy
+    user would hit the database on first access from async code, and every
+    consumer reads it at connect anyway. Connections
+    without a token fall through to the regular session/cookie auth stack,
+    so the session lookup only happens for clients that rely on it.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.session_inner = AuthMiddlewareStack(inner)
+
+    async def __call__(self, scope, receive, send):
+        token, subprotocol = get_token_from_scope(scope)
+        if token is None:
+            return await self.session_inner(scope, receive, send)
+
+        scope = dict(scope)
+        scope['user'] = await get_user_from_token(token) or AnonymousUser()
+        scope['auth_subprotocol'] = subprotocol
+        return await self.inner(scope, receive, send)
+
+
+def JWTAuthMiddlewareStack(inner):
+    return JWTAuthMiddleware(inner)
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:58
+
+from django.db import migrations, models
+
+
+def backfill_read_cursors(apps, schema_editor):
+    # Give every existing membership a cursor at the room's newest message so
+    # old history doesn't suddenly show up as unread
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    RoomParticipant = apps.get_model('chat', 'RoomParticipant')
+    Membership = ChatRoom.participants.through
+    for room in ChatRoom.objects.all().iterator():
+        last_read = room.last_message_id or 0
+        user_ids = Membership.objects.filter(chatroom=room).values_list('user_id', flat=True)
+        RoomParticipant.objects.bulk_create(
+            [RoomParticipant(room=room, user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True,
+        )
+        RoomParticipant.objects.filter(room=room).update(last_read_message_id=last_read)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_chatroom_last_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roomparticipant',
+            name='last_read_message_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'id'], name='chat_msg_room_id_idx'),
+        ),
+        migrations.RunPython(backfill_read_cursors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# Expression indexes on auth_user for chat.directory's prefix search; the
+# expressions must stay identical to chat.directory.prefix_key
+FIELDS = ('username', 'first_name', 'last_name')
+
+STATEMENTS = {
+    'sqlite': 'CREATE INDEX chat_user_{field}_lower_idx ON auth_user (lower({field}))',
+    'postgresql': 'CREATE INDEX chat_user_{field}_lower_idx ON auth_user ((lower({field}) COLLATE "C"))',
+}
+
+
+def create_directory_indexes(apps, schema_editor):
+    statement = STATEMENTS.get(schema_editor.connection.vendor)
+    if statement:
+        for field in FIELDS:
+            schema_editor.execute(statement.format(field=field))
+
+
+def drop_directory_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor in STATEMENTS:
+        for field in FIELDS:
+            schema_editor.execute(f'DROP INDEX IF EXISTS chat_user_{field}_lower_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('chat', '0008_message_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_directory_indexes, drop_directory_indexes),
+    ]
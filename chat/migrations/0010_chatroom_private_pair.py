@@ -0,0 +1,64 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:14
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def merge_rooms(apps, kept, duplicates):
+    """Move duplicate DMs' messages and read positions into the kept room and delete them"""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    RoomParticipant = apps.get_model('chat', 'RoomParticipant')
+
+    # Each user keeps the furthest read position of any copy
+    for user_id, last_read in RoomParticipant.objects.filter(room_id__in=duplicates).values_list('user_id', 'last_read_message_id'):
+        RoomParticipant.objects.filter(
+            room_id=kept, user_id=user_id, last_read_message_id__lt=last_read
+        ).update(last_read_message_id=last_read)
+    Message.objects.filter(room_id__in=duplicates).update(room_id=kept)
+    ChatRoom.objects.filter(id__in=duplicates).delete()
+
+    room = ChatRoom.objects.get(id=kept)
+    last_message = Message.objects.filter(room_id=kept).order_by('-timestamp', '-id').first()
+    room.last_message = last_message
+    room.last_activity_at = last_message.timestamp if last_message else room.created_at
+    room.save(update_fields=['last_message', 'last_activity_at'])
+
+
+def backfill_private_pairs(apps, schema_editor):
+    # Key every two-person private room by its pair of users; where a pair
+    # has several rooms, keep the oldest and fold the others into it
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Membership = ChatRoom.participants.through
+
+    members = defaultdict(list)
+    for room_id, user_id in Membership.objects.filter(chatroom__chat_type='private').values_list('chatroom_id', 'user_id'):
+        members[room_id].append(user_id)
+
+    rooms_by_pair = defaultdict(list)
+    for room_id, user_ids in members.items():
+        if len(user_ids) == 2:
+            rooms_by_pair[f'{min(user_ids)}:{max(user_ids)}'].append(room_id)
+
+    for key, room_ids in rooms_by_pair.items():
+        room_ids.sort()
+        if len(room_ids) > 1:
+            merge_rooms(apps, room_ids[0], room_ids[1:])
+        ChatRoom.objects.filter(id=room_ids[0]).update(private_pair=key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_user_directory_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='private_pair',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_private_pairs, migrations.RunPython.noop),
+    ]
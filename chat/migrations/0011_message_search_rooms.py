@@ -0,0 +1,64 @@
+from importlib import import_module
+
+from django.db import migrations
+
+# Adds room_id to the SQLite FTS5 index so chat.search can restrict a MATCH
+# to the caller's rooms inside the index (room_id : (...) AND content : ...)
+# instead of ranking every matching message first. room_id is tokenized
+# like text; search weights it 0 in bm25(). The update trigger now also
+# fires when a message moves to another room. Postgres needs no change:
+# the room_id filter there uses the existing (room, id) index.
+SQLITE_FORWARD = [
+    'DROP TRIGGER IF EXISTS chat_message_fts_update',
+    'DROP TRIGGER IF EXISTS chat_message_fts_delete',
+    'DROP TRIGGER IF EXISTS chat_message_fts_insert',
+    'DROP TABLE IF EXISTS chat_message_fts',
+    """
+    CREATE VIRTUAL TABLE chat_message_fts USING fts5(
+        content, room_id, content='chat_message', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_message BEGIN
+        INSERT INTO chat_message_fts(rowid, content, room_id) VALUES (new.id, new.content, new.room_id);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content, room_id) VALUES ('delete', old.id, old.content, old.room_id);
+    END
+    """,
+    """
+    CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF content, room_id ON chat_message BEGIN
+        INSERT INTO chat_message_fts(chat_message_fts, rowid, content, room_id) VALUES ('delete', old.id, old.content, old.room_id);
+        INSERT INTO chat_message_fts(rowid, content, room_id) VALUES (new.id, new.content, new.room_id);
+    END
+    """,
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+
+
+def add_room_column(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for sql in SQLITE_FORWARD:
+            schema_editor.execute(sql)
+
+
+def remove_room_column(apps, schema_editor):
+    # Back to the content-only index of 0008
+    if schema_editor.connection.vendor == 'sqlite':
+        previous = import_module('chat.migrations.0008_message_search')
+        for sql in previous.SQLITE_REVERSE + previous.SQLITE_FORWARD:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_chatroom_private_pair'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_room_column, remove_room_column),
+    ]
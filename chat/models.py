@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
 
 class ChatRoom(models.Model):
     CHAT_TYPES = (
@@ -13,9 +15,23 @@ class ChatRoom(models.Model):
     participants = models.ManyToManyField(User, related_name='chat_rooms', blank=True)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_rooms')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized pointer to the newest message so the inbox needs no
+    # per-room subqueries; maintained by record_last_message(). No constraint
+    # and no on_delete action, so Django deletes a room's messages with one
+    # DELETE; message deletes repair it with refresh_stale_last_messages()
+    last_message = models.ForeignKey(
+        'Message', null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+'
+    )
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    # "<min user id>:<max user id>" for private chats, so finding the DM
+    # between two users is one unique-index probe
+    private_pair = models.CharField(max_length=41, null=True, blank=True, unique=True, editable=False)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-last_activity_at'], name='chat_room_last_activity_idx'),
+        ]
 
     def __str__(self):
         if self.chat_type == 'private':
@@ -33,23 +49,92 @@ class ChatRoom(models.Model):
                 return f"Chat with {other_users.first().username}"
         return self.name or "Unnamed Group Chat"
 
+    @staticmethod
+    def pair_key(user_id, other_user_id):
+        return f'{min(user_id, other_user_id)}:{max(user_id, other_user_id)}'
+
+    @classmethod
+    def get_or_create_private(cls, user, other_user):
+        """Return (room, created) for the private chat between two users"""
+        key = cls.pair_key(user.id, other_user.id)
+        room = cls.objects.filter(private_pair=key).first()
+        if room is not None:
+            return room, False
+        try:
+            with transaction.atomic():
+                room = cls.objects.create(chat_type='private', created_by=user, private_pair=key)
+                room.participants.add(user, other_user)
+            return room, True
+        except IntegrityError:
+            # A concurrent request created it first
+            return cls.objects.get(private_pair=key), False
+
+    @classmethod
+    def record_last_message(cls, message):
+        """Point the message's room at it unless a newer message is already recorded"""
+        cls.objects.filter(
+            pk=message.room_id, last_activity_at__lte=message.timestamp
+        ).update(last_message=message, last_activity_at=message.timestamp)
+
+    def refresh_last_message(self):
+        """Recompute last_message/last_activity_at from the messages table"""
+        last_message = self.messages.order_by('-timestamp', '-id').first()
+        self.last_message = last_message
+        self.last_activity_at = last_message.timestamp if last_message else self.created_at
+        self.save(update_fields=['last_message', 'last_activity_at'])
+
+    @classmethod
+    def refresh_stale_last_messages(cls, room_ids):
+        """Recompute last_message of the given rooms whose last message was deleted"""
+        stale = cls.objects.filter(id__in=room_ids, last_message_id__isnull=False).exclude(
+            Exists(Message.objects.filter(pk=OuterRef('last_message_id')))
+        )
+        for room in stale:
+            room.refresh_last_message()
+
+class MessageQuerySet(models.QuerySet):
+    def delete(self):
+        room_ids = set(self.values_list('room_id', flat=True).order_by().distinct())
+        result = super().delete()
+        ChatRoom.refresh_stale_last_messages(room_ids)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
 class Message(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    objects = MessageQuerySet.as_manager()
+
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # Keyset pagination of a room's history on (timestamp, id)
+            models.Index(fields=['room', 'timestamp', 'id'], name='chat_msg_room_ts_id_idx'),
+            # Unread counts: messages in a room above a read cursor
+            models.Index(fields=['room', 'id'], name='chat_msg_room_id_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username}: {self.content[:50]}'
 
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        ChatRoom.refresh_stale_last_messages([self.room_id])
+        return result
+
 class RoomParticipant(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='active_participants')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     joined_at = models.DateTimeField(auto_now_add=True)
     is_online = models.BooleanField(default=False)
+    # Id of the newest message this user has read in the room; messages from
+    # others with a higher id count as unread
+    last_read_message_id = models.BigIntegerField(default=0)
 
     class Meta:
         unique_together = ['room', 'user']
@@ -0,0 +1,218 @@
+import asyncio
+import functools
+import logging
+import weakref
+from collections import deque
+
+from django.conf import settings
+
+from .log import log_event
+from .metrics import register_stats
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_DEFAULTS = {
+    'MAX_SIZE': 256,
+    'POLICY': 'drop_oldest',
+    'CLOSE_CODE': 4008,
+}
+
+POLICIES = ('drop_oldest', 'coalesce', 'disconnect')
+
+
+def get_outbound_settings():
+    conf = {**OUTBOUND_DEFAULTS, **getattr(settings, 'CHAT_OUTBOUND', {})}
+    if conf['POLICY'] not in POLICIES:
+        raise ValueError(f"CHAT_OUTBOUND['POLICY'] must be one of {', '.join(POLICIES)}")
+    return conf
+
+
+class OutboundMetrics:
+    """Process-wide counters shared by every OutboundQueue"""
+
+    def __init__(self):
+        self.queues = weakref.WeakSet()
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.disconnects = 0
+        self.paused = 0
+        self.max_depth = 0
+
+    def stats(self):
+        depths = [len(queue) for queue in list(self.queues)]
+        return {
+            'connections': len(depths),
+            'queue_depth': sum(depths),
+            'max_queue_depth': max(depths, default=0),
+            'max_depth_seen': self.max_depth,
+            'queued': self.queued,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'disconnects': self.disconnects,
+            'paused': self.paused,
+        }
+
+
+outbound_metrics = OutboundMetrics()
+register_stats('chat_outbound', outbound_metrics.stats, 'Outbound WebSocket queues')
+
+
+def server_transport(send):
+    """
+    What to register a Twisted producer with for the socket behind an ASGI
+    ``send`` under daphne, or None.
+
+    Daphne hands each application ``partial(server.handle_reply, protocol)``.
+    After the WebSocket upgrade twisted.web's HTTPChannel is still the
+    socket's producer and passes pause/resume on to a producer registered
+    with it. Other servers (and channels' test communicator) get None.
+    """
+    if not isinstance(send, functools.partial) or not send.args:
+        return None
+    transport = getattr(send.args[0], 'transport', None)
+    consumer = getattr(transport, 'producer', None) or transport
+    return consumer if hasattr(consumer, 'registerProducer') else None
+
+
+class OutboundQueue:
+    """
+    Bounded send queue for one WebSocket connection.
+
+    Channel-layer handlers ``put`` pre-encoded frames and return at once; a
+    writer task drains the queue into the socket, so one slow client never
+    holds up its own inbox. When ``max_size`` frames are pending the policy
+    decides what gives:
+
+        drop_oldest  discard the oldest pending frame
+        coalesce     frames sharing a key (typing, presence) replace each
+                     other in place; when full, evict the oldest keyed frame,
+                     then the oldest frame
+        disconnect   close the connection with ``close_code`` so the client
+                     reconnects and resumes instead of silently missing frames
+
+    A slow client backs up here because the writer stops while the socket
+    can't take more. Servers whose ``websocket.send`` waits for the socket
+    to drain (uvicorn with websockets) stop it by themselves. Daphne's
+    ``send`` returns at once, so with a ``transport`` (see
+    ``server_transport``) the queue registers itself as a streaming
+    producer: Twisted pauses it once the transport buffers more than its
+    limit (64 KiB) and resumes it when the client has read the backlog, and
+    the writer waits in between.
+    """
+
+    def __init__(self, send, close, max_size=256, policy='drop_oldest', close_code=4008, transport=None):
+        self._send = send
+        self._close = close
+        self.max_size = max_size
+        self.policy = policy
+        self.close_code = close_code
+
+        self._frames = deque()  # [key, payload] entries
+        self._keyed = {}  # key -> pending entry
+        self._writer = None
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._transport = transport
+        self.closed = False
+        outbound_metrics.queues.add(self)
+        if transport is not None:
+            try:
+                transport.registerProducer(self, True)
+            except RuntimeError:  # another producer is registered
+                self._transport = None
+
+    def __len__(self):
+        return len(self._frames)
+
+    def put(self, payload, key=None):
+        """Queue a frame (text or bytes); returns False if it was not queued"""
+        if self.closed:
+            return False
+
+        if key is not None and self.policy == 'coalesce' and key in self._keyed:
+            self._keyed[key][1] = payload
+            outbound_metrics.coalesced += 1
+            return True
+
+        if len(self._frames) >= self.max_size:
+            if self.policy == 'disconnect':
+                self._disconnect()
+                return False
+            self._evict()
+
+        entry = [key, payload]
+        self._frames.append(entry)
+        if key is not None and self.policy == 'coalesce':
+            self._keyed[key] = entry
+        outbound_metrics.queued += 1
+        outbound_metrics.max_depth = max(outbound_metrics.max_depth, len(self._frames))
+
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._drain())
+        return True
+
+    def _evict(self):
+        victim = None
+        if self.policy == 'coalesce':
+            for index, entry in enumerate(self._frames):
+                if entry[0] is not None:
+                    victim = entry
+                    del self._frames[index]
+                    break
+        if victim is None:
+            victim = self._frames.popleft()
+        if victim[0] is not None and self._keyed.get(victim[0]) is victim:
+            del self._keyed[victim[0]]
+        outbound_metrics.dropped += 1
+
+    def _disconnect(self):
+        outbound_metrics.disconnects += 1
+        outbound_metrics.dropped += len(self._frames) + 1
+        log_event(logger, logging.WARNING, 'ws.outbound.slow_consumer', pending=len(self._frames), code=self.close_code)
+        self.close()
+        asyncio.get_running_loop().create_task(self._close(code=self.close_code))
+
+    # Twisted streaming producer interface, called on the event loop
+
+    def pauseProducing(self):
+        if self._writable.is_set():
+            outbound_metrics.paused += 1
+        self._writable.clear()
+
+    def resumeProducing(self):
+        self._writable.set()
+
+    def stopProducing(self):
+        self.close()
+
+    async def _drain(self):
+        while self._frames:
+            # Frames stay in the queue, where the policy sees them, until
+            # the transport can take more
+            await self._writable.wait()
+            if not self._frames:
+                break
+            entry = self._frames.popleft()
+            key, payload = entry
+            if key is not None and self._keyed.get(key) is entry:
+                del self._keyed[key]
+            if isinstance(payload, bytes):
+                await self._send(bytes_data=payload)
+            else:
+                await self._send(text_data=payload)
+            outbound_metrics.sent += 1
+
+    def close(self):
+        """Stop sending and drop whatever is pending"""
+        self.closed = True
+        self._frames.clear()
+        self._keyed.clear()
+        self._writable.set()
+        if self._transport is not None:
+            transport, self._transport = self._transport, None
+            transport.unregisterProducer()
+        if self._writer is not None and not self._writer.done() and self._writer is not asyncio.current_task():
+            self._writer.cancel()
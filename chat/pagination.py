@@ -0,0 +1,146 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+
+RESUME_DEFAULTS = {
+    'ENABLED': True,
+    'BATCH_SIZE': 100,
+    'MAX_MESSAGES': 1000,
+}
+
+# Largest value of a 64-bit primary key; bigger ints overflow the database driver
+MAX_ID = 2 ** 63 - 1
+
+
+def get_resume_settings():
+    """Return CHAT_RESUME (WebSocket replay limits) merged over the defaults"""
+    return {**RESUME_DEFAULTS, **getattr(settings, 'CHAT_RESUME', {})}
+
+
+def is_valid_id(value):
+    """True for an int (not a bool) that fits a 64-bit primary key"""
+    return isinstance(value, int) and not isinstance(value, bool) and 0 < value <= MAX_ID
+
+
+def parse_id(value):
+    """Parse an id from a query parameter; None if it isn't a valid one"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if is_valid_id(value) else None
+
+
+def encode_cursor(timestamp, message_id):
+    """Encode a (timestamp, id) position as an opaque cursor"""
+    raw = f'{timestamp.isoformat()}|{message_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor back into (timestamp, id)"""
+    try:
+        timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        position = (parse_datetime(timestamp), int(message_id))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    if position[0] is None or not is_valid_id(position[1]):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    return position
+
+
+def older_than(timestamp, message_id):
+    return Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id)
+
+
+def newer_than(timestamp, message_id):
+    return Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id)
+
+
+def message_position(queryset, message_id):
+    """Return the (timestamp, id) position of a message in queryset, or None"""
+    return queryset.filter(id=message_id).values_list('timestamp', 'id').first()
+
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination over a room's messages ordered by (timestamp, id).
+
+    Query parameters:
+        before    cursor; page of messages older than it
+        after     cursor; page of messages newer than it
+        since_id  message id; like ``after`` but anchored on a message id,
+                  for clients catching up after a reconnect
+        limit     page size (default 50, at most 200)
+
+    Without a position the latest page is returned. Results are always in
+    chronological order, and every page carries ``before``/``after`` cursors
+    for its oldest and newest message. Each page is a single range scan on
+    the (room, timestamp, id) index regardless of how old the room is.
+    """
+
+    page_size = 50
+    max_page_size = 200
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.page_size))
+        except ValueError:
+            raise ValidationError({'limit': 'Must be an integer'})
+        return max(1, min(limit, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        limit = self.get_limit(request)
+        params = request.query_params
+
+        if params.get('since_id'):
+            since_id = parse_id(params['since_id'])
+            if since_id is None:
+                raise ValidationError({'since_id': 'Must be a message id'})
+            anchor = message_position(queryset, since_id)
+            if anchor is None:
+                raise ValidationError({'since_id': 'Unknown message'})
+            forward = True
+        elif params.get('after'):
+            anchor = decode_cursor(params['after'])
+            forward = True
+        elif params.get('before'):
+            anchor = decode_cursor(params['before'])
+            forward = False
+        else:
+            anchor = None
+            forward = False
+
+        if anchor is not None:
+            queryset = queryset.filter(newer_than(*anchor) if forward else older_than(*anchor))
+
+        ordering = ('timestamp', 'id') if forward else ('-timestamp', '-id')
+        page = list(queryset.order_by(*ordering)[:limit + 1])
+        self.has_more = len(page) > limit
+        page = page[:limit]
+        if not forward:
+            page.reverse()
+
+        if page:
+            self.before = encode_cursor(page[0].timestamp, page[0].id)
+            self.after = encode_cursor(page[-1].timestamp, page[-1].id)
+        else:
+            # Nothing in this direction yet; hand the position back so the
+            # client can keep polling from where it is
+            cursor = encode_cursor(*anchor) if anchor is not None else None
+            self.before = self.after = cursor
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'results': data,
+            'has_more': self.has_more,
+            'before': self.before,
+            'after': self.after,
+        })
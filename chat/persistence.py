@@ -0,0 +1,193 @@
+import asyncio
+import atexit
+import logging
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError
+
+from .db import database_sync_to_async
+from .metrics import register_stats
+from .models import ChatRoom, Message
+from .pagination import get_resume_settings
+
+logger = logging.getLogger(__name__)
+
+PERSISTENCE_DEFAULTS = {
+    'MODE': 'sync',
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 0.05,
+    'MAX_PENDING': 5000,
+}
+
+
+def get_persistence_settings():
+    """Return CHAT_MESSAGE_PERSISTENCE merged over the defaults"""
+    return {**PERSISTENCE_DEFAULTS, **getattr(settings, 'CHAT_MESSAGE_PERSISTENCE', {})}
+
+
+def write_behind_enabled():
+    return get_persistence_settings()['MODE'] == 'write_behind'
+
+
+def check_persistence_settings():
+    """
+    Refuse write-behind while WebSocket resume is on.
+
+    Queued messages are broadcast before they have an id, so their frames
+    carry none and clients would have no cursor to resume (or mark_read)
+    from.
+    """
+    mode = get_persistence_settings()['MODE']
+    if mode not in ('sync', 'write_behind'):
+        raise ImproperlyConfigured(f"CHAT_MESSAGE_PERSISTENCE['MODE'] must be 'sync' or 'write_behind', not {mode!r}")
+    if mode == 'write_behind' and get_resume_settings()['ENABLED']:
+        raise ImproperlyConfigured("CHAT_MESSAGE_PERSISTENCE['MODE'] 'write_behind' needs CHAT_RESUME['ENABLED'] = False")
+
+
+class MessageWriteBuffer:
+    """
+    Write-behind queue for chat messages.
+
+    Messages are queued in process and persisted with ``bulk_create`` once
+    ``batch_size`` messages are pending or ``flush_interval`` seconds have
+    passed, whichever comes first. ``max_pending`` caps how many unsaved
+    messages may exist at once: when it is reached ``enqueue`` waits for a
+    flush, so at most that many messages (and at most ``flush_interval``
+    seconds of traffic) can be lost if the process dies.
+    """
+
+    def __init__(self, batch_size=100, flush_interval=0.05, max_pending=5000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._pending = []
+        self._flusher = None
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+        # Counters
+        self.enqueued = 0
+        self.flushed = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    async def enqueue(self, room_id, user_id, content):
+        """Queue a message for persistence and return without touching the database"""
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+        message = Message(room_id=room_id, user_id=user_id, content=content)
+        self._pending.append(message)
+        self.enqueued += 1
+
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        self._ensure_flusher()
+        return message
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            if len(self._pending) < self.batch_size:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await self.flush()
+
+    async def flush(self):
+        """Persist everything currently pending"""
+        async with self._lock:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, []
+            started = time.perf_counter()
+            saved = await database_sync_to_async(self._write_batch)(batch)
+            self._record_flush(started, saved, len(batch))
+            return saved
+
+    def flush_sync(self):
+        """Persist pending messages from synchronous code (used at interpreter exit)"""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, []
+        started = time.perf_counter()
+        saved = self._write_batch(batch)
+        self._record_flush(started, saved, len(batch))
+        return saved
+
+    def _write_batch(self, batch):
+        try:
+            Message.objects.bulk_create(batch, batch_size=self.batch_size)
+            self._record_last_messages(batch)
+            return len(batch)
+        except DatabaseError:
+            # One bad row (e.g. a room deleted meanwhile) must not sink the
+            # whole batch, so fall back to saving messages one at a time.
+            logger.warning('persistence.bulk_create.failed', exc_info=True, extra={'fields': {'size': len(batch)}})
+            saved = 0
+            for message in batch:
+                try:
+                    message.save()
+                    saved += 1
+                except DatabaseError:
+                    logger.error('persistence.message.dropped', extra={'fields': {'room': message.room_id, 'user_id': message.user_id}})
+            return saved
+
+    def _record_last_messages(self, batch):
+        # bulk_create skips post_save, so update each room's last message here
+        newest = {}
+        for message in batch:
+            newest[message.room_id] = message
+        for message in newest.values():
+            if message.pk is not None:
+                ChatRoom.record_last_message(message)
+
+    def _record_flush(self, started, saved, size):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.flushes += 1
+        self.flushed += saved
+        self.failed += size - saved
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    def stats(self):
+        return {
+            'queue_depth': len(self._pending),
+            'enqueued': self.enqueued,
+            'flushed': self.flushed,
+            'failed': self.failed,
+            'flushes': self.flushes,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'max_flush_ms': round(self.max_flush_ms, 3),
+            'avg_flush_ms': round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+
+_message_buffer = None
+
+
+def get_message_buffer():
+    """Return the process-wide write buffer, creating it on first use"""
+    global _message_buffer
+    if _message_buffer is None:
+        conf = get_persistence_settings()
+        _message_buffer = MessageWriteBuffer(
+            batch_size=conf['BATCH_SIZE'],
+            flush_interval=conf['FLUSH_INTERVAL'],
+            max_pending=conf['MAX_PENDING'],
+        )
+        atexit.register(_message_buffer.flush_sync)
+        register_stats('chat_message_buffer', _message_buffer.stats, 'Write-behind message buffer')
+    return _message_buffer
@@ -0,0 +1,193 @@
+import asyncio
+import atexit
+import logging
+import time
+from functools import reduce
+from operator import or_
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Q
+
+from .db import database_sync_to_async
+from .groups import frame_event, room_group_name, send_to_group
+from .log import log_event
+from .metrics import register_stats
+from .models import RoomParticipant
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_DEFAULTS = {
+    'TTL': 60,
+    'FLUSH_INTERVAL': 2.0,
+}
+
+
+class PresenceTracker:
+    """
+    In-process presence for WebSocket sessions.
+
+    Every connection registers as a session of (room, user); a user is online
+    in a room while at least one session is alive, so several tabs are
+    counted once. Sessions that send nothing (heartbeats included) for
+    ``ttl`` seconds expire until their connection sends again. Lookups are
+    dictionary hits and never touch the database. Only actual online/offline
+    transitions are recorded on RoomParticipant, coalesced and written in
+    batches every ``flush_interval`` seconds.
+
+    State is per process: with several workers each one tracks the
+    connections it serves.
+    """
+
+    def __init__(self, ttl=60, flush_interval=2.0):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+
+        self._sessions = {}  # room_id -> {user_id: {channel_name: last_seen}}
+        self._usernames = {}  # user_id -> username
+        self._pending = {}  # (room_id, user_id) -> is_online, not yet written
+        self._sweeper = None
+
+        # Counters
+        self.transitions = 0
+        self.expired = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    def join(self, room_id, user, channel_name):
+        """Register a session; returns True if the user just came online in the room"""
+        users = self._sessions.setdefault(room_id, {})
+        came_online = user.id not in users
+        users.setdefault(user.id, {})[channel_name] = time.monotonic()
+        self._usernames[user.id] = user.username
+        if came_online:
+            self._transition(room_id, user.id, True)
+        self._ensure_sweeper()
+        return came_online
+
+    def heartbeat(self, room_id, user, channel_name):
+        """
+        Refresh a session. One that already expired is registered again, so
+        a connection that went quiet comes back online as soon as it sends
+        anything; returns True if the user just came online in the room.
+        """
+        sessions = self._sessions.get(room_id, {}).get(user.id)
+        if sessions is not None and channel_name in sessions:
+            sessions[channel_name] = time.monotonic()
+            return False
+        return self.join(room_id, user, channel_name)
+
+    def leave(self, room_id, user_id, channel_name):
+        """Drop a session; returns True if that was the user's last one in the room"""
+        users = self._sessions.get(room_id)
+        if not users or user_id not in users:
+            return False
+        users[user_id].pop(channel_name, None)
+        if users[user_id]:
+            return False
+        del users[user_id]
+        if not users:
+            del self._sessions[room_id]
+        self._transition(room_id, user_id, False)
+        return True
+
+    def is_online(self, room_id, user_id):
+        return user_id in self._sessions.get(room_id, {})
+
+    def active_users(self, room_id):
+        return [
+            {'user_id': user_id, 'user': self._usernames.get(user_id)}
+            for user_id in self._sessions.get(room_id, {})
+        ]
+
+    def _transition(self, room_id, user_id, is_online):
+        self.transitions += 1
+        self._pending[(room_id, user_id)] = is_online
+
+    def expire(self):
+        """Drop sessions idle for longer than ttl; returns (room_id, user_id) pairs that went offline"""
+        deadline = time.monotonic() - self.ttl
+        offline = []
+        for room_id, users in list(self._sessions.items()):
+            for user_id, sessions in list(users.items()):
+                for channel_name, last_seen in list(sessions.items()):
+                    if last_seen < deadline:
+                        self.expired += 1
+                        if self.leave(room_id, user_id, channel_name):
+                            offline.append((room_id, user_id))
+        return offline
+
+    def _ensure_sweeper(self):
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._sessions or self._pending:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                for room_id, user_id in self.expire():
+                    await self.broadcast_activity(room_id, user_id, 'left')
+                await self.flush()
+            except Exception:
+                logger.exception('presence.sweep.error')
+
+    async def broadcast_activity(self, room_id, user_id, action):
+        """Tell the room a user came online or went offline"""
+        channel_layer = get_channel_layer()
+        await send_to_group(channel_layer, room_group_name(room_id), frame_event('user_activity', {
+            'type': 'user_activity',
+            'room_id': room_id,
+            'action': action,
+            'user': self._usernames.get(user_id),
+            'user_id': user_id,
+        }, coalesce_key=f'activity:{room_id}:{user_id}'))
+
+    async def flush(self):
+        if self._pending:
+            pending, self._pending = self._pending, {}
+            await database_sync_to_async(self._write)(pending)
+
+    def flush_sync(self):
+        """Mark every tracked session offline and persist it (used at interpreter exit)"""
+        for room_id, users in self._sessions.items():
+            for user_id in users:
+                self._pending[(room_id, user_id)] = False
+        self._sessions = {}
+        if self._pending:
+            pending, self._pending = self._pending, {}
+            self._write(pending)
+
+    def _write(self, pending):
+        for is_online in (True, False):
+            pairs = [key for key, value in pending.items() if value is is_online]
+            for start in range(0, len(pairs), 200):
+                condition = reduce(or_, (Q(room_id=room_id, user_id=user_id) for room_id, user_id in pairs[start:start + 200]))
+                self.rows_written += RoomParticipant.objects.filter(condition).update(is_online=is_online)
+        self.flushes += 1
+        log_event(logger, logging.DEBUG, 'presence.flush', changes=len(pending))
+
+    def stats(self):
+        return {
+            'rooms': len(self._sessions),
+            'online': sum(len(users) for users in self._sessions.values()),
+            'sessions': sum(len(s) for users in self._sessions.values() for s in users.values()),
+            'pending_writes': len(self._pending),
+            'transitions': self.transitions,
+            'expired': self.expired,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+        }
+
+
+_presence = None
+
+
+def get_presence():
+    """Return the process-wide presence tracker, creating it on first use"""
+    global _presence
+    if _presence is None:
+        conf = {**PRESENCE_DEFAULTS, **getattr(settings, 'CHAT_PRESENCE', {})}
+        _presence = PresenceTracker(ttl=conf['TTL'], flush_interval=conf['FLUSH_INTERVAL'])
+        atexit.register(_presence.flush_sync)
+        register_stats('chat_presence', _presence.stats, 'Presence tracker')
+    return _presence
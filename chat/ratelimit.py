@@ -0,0 +1,109 @@
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+RATE_LIMIT_DEFAULTS = {
+    'BACKEND': 'local',
+    'CACHE': 'default',
+    'USER': {'RATE': 5, 'BURST': 10},
+    'ROOM': {'RATE': 50, 'BURST': 100},
+    'MAX_FRAME_SIZE': 16384,
+    'MAX_MESSAGE_LENGTH': 4000,
+    'MAX_VIOLATIONS': 10,
+    'CLOSE_CODE': 4029,
+}
+
+
+def get_rate_limit_settings():
+    return {**RATE_LIMIT_DEFAULTS, **getattr(settings, 'CHAT_RATE_LIMITS', {})}
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated')
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.updated = now
+
+
+class LocalRateLimiter:
+    """
+    In-process token buckets keyed by strings such as ``user:42``.
+
+    Each key refills at ``rate`` tokens per second up to ``burst``. A bucket
+    is two floats; the least recently used ones are dropped beyond
+    ``max_keys`` (a dropped bucket simply starts full again).
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def hit(self, key):
+        """Take a token; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.burst, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0
+        return (1 - bucket.tokens) / self.rate
+
+
+class CacheRateLimiter:
+    """
+    Rate limiter shared by every worker through Django's cache.
+
+    Counts hits in fixed windows of ``burst / rate`` seconds, allowing
+    ``burst`` per window, which matches the token bucket's long-run rate.
+    Point CACHE at a shared backend (e.g. Redis) for cross-worker limits.
+    """
+
+    def __init__(self, rate, burst, cache_alias='default'):
+        self.rate = rate
+        self.burst = burst
+        self.window = burst / rate
+        self.cache = caches[cache_alias]
+
+    async def hit(self, key):
+        now = time.time()
+        window = int(now // self.window)
+        cache_key = f'chat-ratelimit:{key}:{window}'
+        timeout = int(self.window) + 1
+        await self.cache.aadd(cache_key, 0, timeout)
+        try:
+            count = await self.cache.aincr(cache_key)
+        except ValueError:
+            # Expired between add and incr
+            await self.cache.aset(cache_key, 1, timeout)
+            count = 1
+        if count <= self.burst:
+            return 0
+        return (window + 1) * self.window - now
+
+
+_limiters = {}
+
+
+def get_rate_limiter(scope):
+    """Return the process-wide limiter for 'USER' or 'ROOM' keys"""
+    if scope not in _limiters:
+        conf = get_rate_limit_settings()
+        limits = conf[scope]
+        if conf['BACKEND'] == 'cache':
+            _limiters[scope] = CacheRateLimiter(limits['RATE'], limits['BURST'], conf['CACHE'])
+        else:
+            _limiters[scope] = LocalRateLimiter(limits['RATE'], limits['BURST'])
+    return _limiters[scope]
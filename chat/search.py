@@ -0,0 +1,165 @@
+import base64
+import binascii
+import re
+
+from django.conf import settings
+from django.db import connection
+from rest_framework.exceptions import ValidationError
+
+from .models import ChatRoom, Message
+from .pagination import is_valid_id
+
+MAX_TERMS = 8
+TERM_RE = re.compile(r'\w+')
+
+SEARCH_DEFAULTS = {
+    'MAX_CANDIDATES': 1000,
+}
+
+
+def get_search_settings():
+    return {**SEARCH_DEFAULTS, **getattr(settings, 'CHAT_SEARCH', {})}
+
+
+def parse_terms(query):
+    """Split a user query into plain word terms; operators and quotes are dropped"""
+    return TERM_RE.findall(query or '')[:MAX_TERMS]
+
+
+def encode_search_cursor(score, message_id):
+    raw = f'{score!r}|{message_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_search_cursor(cursor):
+    try:
+        score, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        position = float(score), int(message_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    if not is_valid_id(position[1]):
+        raise ValidationError({'cursor': 'Invalid cursor'})
+    return position
+
+
+def fts5_match(terms, room_ids):
+    # Quoted so every term is literal; the last one also matches as a prefix.
+    # The room filter is part of the match, so the index only yields rows
+    # from the caller's rooms (room_id is an indexed column, migration 0011)
+    rooms = ' OR '.join(f'"{room_id}"' for room_id in room_ids)
+    words = ' '.join(f'"{term}"' for term in terms) + '*'
+    return f'room_id : ({rooms}) AND content : ({words})'
+
+
+def tsquery(terms):
+    return ' & '.join(terms) + ':*'
+
+
+def ranked_sql(vendor, after):
+    """
+    SQL returning (id, score, candidates) of matching messages, best first;
+    None if unsupported.
+
+    The inner query takes the newest matches in the given rooms, at most
+    MAX_CANDIDATES of them; only those are scored and ranked. ``candidates``
+    is how many it took, before the cursor applies.
+    """
+    if vendor == 'sqlite':
+        # bm25() is lower-is-better; negate so both backends sort score DESC.
+        # The room_id column carries no weight in the score
+        inner = """
+            SELECT rowid AS id, -bm25(chat_message_fts, 1.0, 0.0) AS score
+            FROM chat_message_fts
+            WHERE chat_message_fts MATCH %s
+            ORDER BY rowid DESC LIMIT %s
+        """
+    elif vendor == 'postgresql':
+        inner = """
+            SELECT m.id AS id, ts_rank(to_tsvector('simple', m.content), q.query) AS score
+            FROM chat_message m
+            CROSS JOIN to_tsquery('simple', %s) AS q(query)
+            WHERE to_tsvector('simple', m.content) @@ q.query AND m.room_id = ANY(%s)
+            ORDER BY m.id DESC LIMIT %s
+        """
+    else:
+        return None
+    where = 'WHERE ranked.score < %s OR (ranked.score = %s AND ranked.id < %s)' if after else ''
+    return f"""
+        SELECT ranked.id, ranked.score, ranked.candidates
+        FROM (SELECT c.id, c.score, COUNT(*) OVER () AS candidates FROM ({inner}) c) ranked
+        {where} ORDER BY ranked.score DESC, ranked.id DESC LIMIT %s
+    """
+
+
+def search_messages(user, query, room_id=None, cursor=None, limit=20):
+    """
+    Full-text search over messages in the rooms ``user`` belongs to.
+
+    Uses the FTS5 table on SQLite and the GIN expression index on Postgres
+    (migrations 0008 and 0011), restricted to the caller's rooms (or just
+    ``room_id``) before anything is scored. Ranking covers the newest
+    MAX_CANDIDATES matches of CHAT_SEARCH, so its cost depends on neither
+    the table size nor how common a term is elsewhere. Terms are ANDed and
+    the last one matches as a prefix. Returns ``(messages, has_more,
+    next_cursor, truncated)`` ordered by relevance, each message carrying
+    its ``score``; pass ``next_cursor`` back for the next page.
+    ``truncated`` means the cap was hit and older matches were left out;
+    a narrower query finds them.
+    """
+    terms = parse_terms(query)
+    if not terms:
+        return [], False, None, False
+    after = decode_search_cursor(cursor) if cursor else None
+
+    room_ids = ChatRoom.participants.through.objects.filter(user=user)
+    if room_id is not None:
+        room_ids = room_ids.filter(chatroom_id=room_id)
+    room_ids = list(room_ids.values_list('chatroom_id', flat=True))
+    if not room_ids:
+        return [], False, None, False
+
+    sql = ranked_sql(connection.vendor, after)
+    if sql is None:
+        return _scan(terms, room_ids, after, limit)
+
+    max_candidates = get_search_settings()['MAX_CANDIDATES']
+    if connection.vendor == 'sqlite':
+        params = [fts5_match(terms, room_ids), max_candidates]
+    else:
+        params = [tsquery(terms), room_ids, max_candidates]
+    if after:
+        params.extend([after[0], after[0], after[1]])
+    params.append(limit + 1)
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        rows = db_cursor.fetchall()
+
+    truncated = bool(rows) and rows[0][2] >= max_candidates
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    messages = Message.objects.select_related('user').in_bulk([message_id for message_id, _, _ in rows])
+    results = []
+    for message_id, score, _ in rows:
+        # Skips a message deleted between the two queries
+        if message_id in messages:
+            message = messages[message_id]
+            message.score = score
+            results.append(message)
+    next_cursor = encode_search_cursor(rows[-1][1], rows[-1][0]) if has_more else None
+    return results, has_more, next_cursor, truncated
+
+
+def _scan(terms, room_ids, after, limit):
+    # Backends without an index: newest matches first, every score 0
+    queryset = Message.objects.filter(room_id__in=room_ids).select_related('user')
+    for term in terms:
+        queryset = queryset.filter(content__icontains=term)
+    if after:
+        queryset = queryset.filter(id__lt=after[1])
+    results = list(queryset.order_by('-id')[:limit + 1])
+    has_more = len(results) > limit
+    results = results[:limit]
+    for message in results:
+        message.score = 0.0
+    next_cursor = encode_search_cursor(0.0, results[-1].id) if has_more else None
+    return results, has_more, next_cursor, False
@@ -1,16 +1,20 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.urls import reverse
 from .models import ChatRoom, Message, RoomParticipant
-
-from rest_framework import serializers
-from django.contrib.auth.models import User
-from .models import ChatRoom, Message, RoomParticipant
+from .pagination import encode_cursor
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
 
+class UserDirectorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name']
+
 class MessageSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
     timestamp = serializers.DateTimeField(format='%Y-%m-%d %H:%M:%S', read_only=True)
@@ -20,6 +24,12 @@ class MessageSerializer(serializers.ModelSerializer):
         fields = ['id', 'room', 'user', 'content', 'timestamp']
         read_only_fields = ['timestamp']
 
+class MessageSearchResultSerializer(MessageSerializer):
+    score = serializers.FloatField(read_only=True)
+
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ['score']
+
 class ChatRoomListSerializer(serializers.ModelSerializer):
     display_name = serializers.SerializerMethodField()
     last_message = serializers.SerializerMethodField()
@@ -35,22 +45,20 @@ class ChatRoomListSerializer(serializers.ModelSerializer):
         user = request.user if request else None
         
         if obj.chat_type == 'private':
+            # Precomputed by ChatRoomViewSet.get_queryset
+            if hasattr(obj, 'other_participant_username'):
+                if obj.other_participant_username:
+                    return f"Chat with {obj.other_participant_username}"
+                return obj.name or "Group Chat"
+
             other_users = obj.participants.exclude(id=user.id) if user else obj.participants.all()
             if other_users.exists():
                 return f"Chat with {other_users.first().username}"
         return obj.name or "Group Chat"
 
     def get_last_message(self, obj):
-        # Use annotated fields if available
-        if hasattr(obj, 'last_message_content') and obj.last_message_content:
-            return {
-                'content': obj.last_message_content[:50] + '...' if len(obj.last_message_content) > 50 else obj.last_message_content,
-                'user': obj.last_message_user,
-                'timestamp': obj.last_message_time
-            }
-        
-        # Fallback to querying the last message
-        last_msg = obj.messages.last()
+        # Denormalized on the room and joined by ChatRoomViewSet.get_queryset
+        last_msg = obj.last_message
         if last_msg:
             return {
                 'content': last_msg.content[:50] + '...' if len(last_msg.content) > 50 else last_msg.content,
@@ -60,26 +68,69 @@ class ChatRoomListSerializer(serializers.ModelSerializer):
         return None
 
     def get_unread_count(self, obj):
-        return 0  # You can implement this later
+        # Annotated by ChatRoomViewSet.get_queryset from the user's read cursor
+        return getattr(obj, 'unread_count', 0)
 
 class ChatRoomDetailSerializer(serializers.ModelSerializer):
-    messages = MessageSerializer(many=True, read_only=True)
+    """
+    Room detail with only the latest messages embedded.
+
+    Older history is fetched from the paginated ``messages`` endpoint using
+    ``history.before``; the embedded page costs one query however big the
+    room is. The page size comes from the ``recent_messages`` context key or
+    the CHAT_RECENT_MESSAGES setting.
+    """
+    messages = serializers.SerializerMethodField()
+    history = serializers.SerializerMethodField()
     display_name = serializers.SerializerMethodField()
     participants = UserSerializer(many=True, read_only=True)
     created_by = UserSerializer(read_only=True)
     
     class Meta:
         model = ChatRoom
-        fields = ['id', 'name', 'chat_type', 'display_name', 'participants', 'created_by', 'messages', 'created_at']
+        fields = ['id', 'name', 'chat_type', 'display_name', 'participants', 'created_by', 'messages', 'history', 'created_at']
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._recent_messages = {}
+
+    def get_recent_messages(self, obj):
+        """Latest messages of the room in chronological order, plus whether there are older ones"""
+        cache = self._recent_messages
+        if obj.pk not in cache:
+            limit = self.context.get('recent_messages', getattr(settings, 'CHAT_RECENT_MESSAGES', 50))
+            recent = list(
+                Message.objects.filter(room=obj).select_related('user').order_by('-timestamp', '-id')[:limit + 1]
+            )
+            has_more = len(recent) > limit
+            recent = recent[:limit]
+            recent.reverse()
+            cache[obj.pk] = (recent, has_more)
+        return cache[obj.pk]
+
+    def get_messages(self, obj):
+        recent, _ = self.get_recent_messages(obj)
+        return MessageSerializer(recent, many=True).data
+
+    def get_history(self, obj):
+        recent, has_more = self.get_recent_messages(obj)
+        request = self.context.get('request')
+        url = reverse('chatroom-messages', kwargs={'pk': obj.pk})
+        return {
+            'url': request.build_absolute_uri(url) if request else url,
+            'before': encode_cursor(recent[0].timestamp, recent[0].id) if recent else None,
+            'has_more': has_more,
+        }
 
     def get_display_name(self, obj):
         request = self.context.get('request')
         user = request.user if request else None
         
         if obj.chat_type == 'private':
-            other_users = obj.participants.exclude(id=user.id) if user else obj.participants.all()
-            if other_users.exists():
-                return f"Chat with {other_users.first().username}"
+            # Iterate .all() so prefetched participants are reused
+            other_users = [p for p in obj.participants.all() if not user or p.id != user.id]
+            if other_users:
+                return f"Chat with {other_users[0].username}"
         return obj.name or "Group Chat"
 
 class PrivateChatCreateSerializer(serializers.Serializer):
@@ -90,7 +141,7 @@ class RoomParticipantSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = RoomParticipant
-        fields = ['user', 'joined_at', 'is_online']
+        fields = ['user', 'joined_at', 'is_online', 'last_read_message_id']
 
 
 
@@ -0,0 +1,107 @@
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .auth import get_token_user_cache
+from .groups import room_group_name, send_to_group
+from .models import ChatRoom, Message, RoomParticipant
+
+logger = logging.getLogger(__name__)
+
+
+def notify_room(room_id, event):
+    """Send an event to every connection of a room once the transaction commits"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    def send():
+        try:
+            async_to_sync(send_to_group)(channel_layer, room_group_name(room_id), event)
+        except Exception:
+            logger.exception('room.notify.error', extra={'fields': {'room': room_id, 'event': event['type']}})
+
+    transaction.on_commit(send)
+
+
+@receiver(post_delete, sender=ChatRoom)
+def room_deleted(sender, instance, **kwargs):
+    notify_room(instance.id, {'type': 'room_deleted', 'room_id': instance.id})
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        # room.participants.add/remove/clear(...)
+        if action == 'post_add':
+            add_read_cursors([(instance.id, user_id, instance.last_message_id) for user_id in pk_set])
+        elif action == 'post_remove':
+            RoomParticipant.objects.filter(room=instance, user_id__in=pk_set).delete()
+            release_private_pairs([instance.id])
+            notify_room(instance.id, {'type': 'participants_removed', 'room_id': instance.id, 'user_ids': list(pk_set)})
+        elif action == 'post_clear':
+            RoomParticipant.objects.filter(room=instance).delete()
+            release_private_pairs([instance.id])
+            notify_room(instance.id, {'type': 'participants_removed', 'room_id': instance.id, 'user_ids': None})
+        return
+
+    # user.chat_rooms.add/remove/clear(...)
+    if action == 'post_add':
+        rooms = ChatRoom.objects.filter(id__in=pk_set).values_list('id', 'last_message_id')
+        add_read_cursors([(room_id, instance.id, last_message_id) for room_id, last_message_id in rooms])
+    elif action == 'pre_clear':
+        instance._cleared_room_ids = list(instance.chat_rooms.values_list('id', flat=True))
+    elif action in ('post_remove', 'post_clear'):
+        room_ids = pk_set if action == 'post_remove' else getattr(instance, '_cleared_room_ids', [])
+        RoomParticipant.objects.filter(user=instance, room_id__in=room_ids).delete()
+        release_private_pairs(room_ids)
+        for room_id in room_ids:
+            notify_room(room_id, {'type': 'participants_removed', 'room_id': room_id, 'user_ids': [instance.id]})
+
+
+def release_private_pairs(room_ids):
+    """A private chat someone left no longer answers for that pair of users"""
+    ChatRoom.objects.filter(id__in=room_ids, private_pair__isnull=False).update(private_pair=None)
+
+
+def add_read_cursors(memberships):
+    """Create RoomParticipant rows for new members, with nothing unread yet"""
+    RoomParticipant.objects.bulk_create(
+        [
+            RoomParticipant(room_id=room_id, user_id=user_id, last_read_message_id=last_message_id or 0)
+            for room_id, user_id, last_message_id in memberships
+        ],
+        ignore_conflicts=True,
+    )
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    # Deactivations and profile changes must not be served from the auth cache
+    get_token_user_cache().invalidate(instance.id)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    # The user's messages go with one DELETE; remember the rooms whose last
+    # message is among them. No delete signals on Message itself, or Django
+    # would load and delete messages row by row.
+    instance._last_message_room_ids = list(
+        ChatRoom.objects.filter(last_message__user=instance).values_list('id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    ChatRoom.refresh_stale_last_messages(getattr(instance, '_last_message_room_ids', []))
+
+
+@receiver(post_save, sender=Message)
+def message_saved(sender, instance, created, **kwargs):
+    if created:
+        ChatRoom.record_last_message(instance)
@@ -0,0 +1,401 @@
+import asyncio
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat_app.asgi import application
+
+from .auth import TokenUserCache
+from .models import ChatRoom, Message
+from .outbound import OutboundQueue
+from .pagination import encode_cursor
+
+
+class ChatListQueryCountTests(TestCase):
+    """my_chats and list cost the same number of queries however many rooms there are"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.rooms = 0
+
+    def add_rooms(self, count):
+        for _ in range(count):
+            self.rooms += 1
+            other = User.objects.create(username=f'other{self.rooms}')
+            private, _ = ChatRoom.get_or_create_private(self.user, other)
+            Message.objects.create(room=private, user=other, content='hello')
+            group = ChatRoom.objects.create(name=f'group {self.rooms}', created_by=self.user)
+            group.participants.add(self.user, other)
+            Message.objects.create(room=group, user=self.user, content='hi all')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, url):
+        self.add_rooms(5)
+        baseline = self.count_queries(url)
+        self.add_rooms(5)
+        with self.assertNumQueries(baseline):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_my_chats(self):
+        self.assert_constant_queries('/api/chat/rooms/my_chats/')
+
+    def test_list(self):
+        self.assert_constant_queries('/api/chat/rooms/')
+
+    def test_private_chat_display_name(self):
+        self.add_rooms(1)
+        response = self.client.get('/api/chat/rooms/my_chats/')
+        names = {room['chat_type']: room['display_name'] for room in response.json()}
+        self.assertEqual(names['private'], 'Chat with other1')
+        self.assertEqual(names['group'], 'group 1')
+
+
+class MessageSearchScopeTests(TestCase):
+    """Search only sees the caller's rooms, however many other rooms match"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.stranger = User.objects.create(username='stranger')
+        self.room = ChatRoom.objects.create(name='mine', created_by=self.user)
+        self.room.participants.add(self.user)
+        self.other_room = ChatRoom.objects.create(name='theirs', created_by=self.stranger)
+        self.other_room.participants.add(self.stranger)
+        for _ in range(5):
+            Message.objects.create(room=self.other_room, user=self.stranger, content='launch plan')
+        self.mine = Message.objects.create(room=self.room, user=self.user, content='launch plan draft')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        response = self.client.get('/api/chat/messages/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return [message['id'] for message in response.json()['results']]
+
+    def test_only_own_rooms(self):
+        self.assertEqual(self.search(q='launch'), [self.mine.id])
+
+    def test_room_filter(self):
+        self.assertEqual(self.search(q='launch', room=self.room.id), [self.mine.id])
+        self.assertEqual(self.search(q='launch', room=self.other_room.id), [])
+
+    def test_moved_message(self):
+        self.mine.room = self.other_room
+        self.mine.save()
+        self.assertEqual(self.search(q='launch'), [])
+
+    def test_room_out_of_range(self):
+        response = self.client.get('/api/chat/messages/search/', {'q': 'launch', 'room': '99999999999999999999999'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_truncated(self):
+        for _ in range(3):
+            Message.objects.create(room=self.room, user=self.user, content='launch plan')
+        with self.settings(CHAT_SEARCH={'MAX_CANDIDATES': 2}):
+            response = self.client.get('/api/chat/messages/search/', {'q': 'launch'})
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertTrue(response.json()['truncated'])
+        response = self.client.get('/api/chat/messages/search/', {'q': 'launch'})
+        self.assertEqual(len(response.json()['results']), 4)
+        self.assertFalse(response.json()['truncated'])
+
+
+class LastMessageDeleteTests(TestCase):
+    """Deletes keep last_message right without touching messages row by row"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.other = User.objects.create(username='other')
+        self.room = ChatRoom.objects.create(name='room', created_by=self.user)
+        self.room.participants.add(self.user, self.other)
+
+    def post(self, user, count=1):
+        return [Message.objects.create(room=self.room, user=user, content='hi') for _ in range(count)]
+
+    def last_message_id(self):
+        return ChatRoom.objects.get(pk=self.room.pk).last_message_id
+
+    def test_delete_newest_message(self):
+        first, newest = self.post(self.user, 2)
+        newest.delete()
+        self.assertEqual(self.last_message_id(), first.id)
+
+    def test_queryset_delete(self):
+        first, = self.post(self.user)
+        self.post(self.other, 3)
+        Message.objects.filter(user=self.other).delete()
+        self.assertEqual(self.last_message_id(), first.id)
+
+    def test_delete_user(self):
+        first, = self.post(self.user)
+        self.post(self.other, 3)
+        self.other.delete()
+        self.assertEqual(self.last_message_id(), first.id)
+
+    def test_delete_room_constant_queries(self):
+        self.post(self.user, 5)
+        with CaptureQueriesContext(connection) as queries:
+            ChatRoom.objects.get(pk=self.room.pk).delete()
+        room = ChatRoom.objects.create(name='room', created_by=self.user)
+        room.participants.add(self.user, self.other)
+        Message.objects.bulk_create([Message(room=room, user=self.user, content='hi') for _ in range(250)])
+        with self.assertNumQueries(len(queries)):
+            ChatRoom.objects.get(pk=room.pk).delete()
+        self.assertFalse(Message.objects.exists())
+
+
+class TokenUserCacheTests(TransactionTestCase):
+    """Saving a user drops only that user's cached tokens"""
+
+    def test_invalidate_one_user(self):
+        cache = TokenUserCache()
+        alice = User.objects.create(username='alice')
+        bob = User.objects.create(username='bob')
+        exp = time.time() + 600
+        for jti, user in (('a1', alice), ('a2', alice), ('b1', bob)):
+            async_to_sync(cache.get_user)({'user_id': user.id, 'jti': jti, 'exp': exp})
+        cache.invalidate(alice.id)
+        self.assertEqual(list(cache._entries), ['b1'])
+        self.assertEqual(set(cache._keys_by_user), {bob.id})
+
+
+class MessagePaginationTests(TestCase):
+    """Out-of-range ids in query parameters are a 400, not a database error"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.room = ChatRoom.objects.create(name='room', created_by=self.user)
+        self.room.participants.add(self.user)
+        self.message = Message.objects.create(room=self.room, user=self.user, content='hi')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, **params):
+        return self.client.get(f'/api/chat/rooms/{self.room.id}/messages/', params)
+
+    def test_since_id(self):
+        self.assertEqual(self.get(since_id=self.message.id).status_code, 200)
+        for since_id in ('99999999999999999999999', '-1', 'abc'):
+            self.assertEqual(self.get(since_id=since_id).status_code, 400)
+
+    def test_cursor_id_out_of_range(self):
+        cursor = encode_cursor(self.message.timestamp, 10 ** 23)
+        self.assertEqual(self.get(after=cursor).status_code, 400)
+
+
+class ConsumerTestCase(TransactionTestCase):
+    """WebSocket tests over the in-process channel layer (no Redis needed)"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.room = ChatRoom.objects.create(name='room', created_by=self.user)
+        self.room.participants.add(self.user)
+
+    async def connect(self, path=None, user=None):
+        token = str(AccessToken.for_user(user or self.user))
+        path = path or f'ws/chat/{self.room.id}/'
+        communicator = WebsocketCommunicator(application, f'/{path}?token={token}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive_type(self, communicator, frame_type):
+        # Skips presence and other frames sent in between
+        while True:
+            frame = await communicator.receive_json_from(timeout=2)
+            if frame['type'] == frame_type:
+                return frame
+
+
+class ChatConsumerTests(ConsumerTestCase):
+
+    async def test_message_broadcast(self):
+        communicator = await self.connect()
+        await self.receive_type(communicator, 'connection_established')
+        await communicator.send_json_to({'message': 'hello'})
+        frame = await self.receive_type(communicator, 'chat_message')
+        self.assertEqual(frame['message'], 'hello')
+        await communicator.disconnect()
+
+    async def test_typing_throttled_per_user(self):
+        # Two tabs of the same user broadcast one indicator between them
+        watcher = await sync_to_async(User.objects.create)(username='watcher')
+        await sync_to_async(self.room.participants.add)(watcher)
+        listener = await self.connect(user=watcher)
+        tabs = [await self.connect(), await self.connect()]
+        for tab in tabs:
+            await tab.send_json_to({'type': 'typing'})
+        frame = await self.receive_type(listener, 'typing')
+        self.assertEqual((frame['user_id'], frame['is_typing']), (self.user.id, True))
+        while not await listener.receive_nothing(timeout=0.3):
+            self.assertNotEqual((await listener.receive_json_from())['type'], 'typing')
+        for tab in tabs:
+            await tab.disconnect()
+        frame = await self.receive_type(listener, 'typing')
+        self.assertFalse(frame['is_typing'])
+        await listener.disconnect()
+
+    async def test_resume_rejects_bad_ids(self):
+        # Resume is allowed once per room and session, so one connection each
+        for last_message_id in ('1e999', '100000000000000000000000', 'true', '"1"', '-1'):
+            communicator = await self.connect()
+            await communicator.send_to(text_data='{"type": "resume", "last_message_id": %s}' % last_message_id)
+            frame = await self.receive_type(communicator, 'error')
+            self.assertEqual(frame['code'], 'invalid_message_id')
+            await communicator.disconnect()
+
+    async def test_mark_read_rejects_bad_ids(self):
+        communicator = await self.connect()
+        for message_id in ('100000000000000000000000', 'true', '0', '"1"'):
+            await communicator.send_to(text_data='{"type": "mark_read", "message_id": %s}' % message_id)
+            frame = await self.receive_type(communicator, 'error')
+            self.assertEqual(frame['code'], 'invalid_message_id')
+        await communicator.disconnect()
+
+
+class MultiplexConsumerTests(ConsumerTestCase):
+
+    async def test_rejects_bad_room_ids(self):
+        communicator = await self.connect('ws/chat/')
+        for room_id in ('[1]', '{}', 'true', '100000000000000000000000'):
+            await communicator.send_to(text_data='{"type": "typing", "room_id": %s}' % room_id)
+            frame = await self.receive_type(communicator, 'error')
+            self.assertEqual(frame['code'], 'invalid_room_id')
+            await communicator.send_to(text_data='{"type": "subscribe", "room_id": %s}' % room_id)
+            frame = await self.receive_type(communicator, 'error')
+            self.assertEqual(frame['code'], 'invalid_room_id')
+        await communicator.disconnect()
+
+
+class RecentContactsTests(TestCase):
+    """The directory's recent section comes from recent private chats only"""
+
+    def setUp(self):
+        self.user = User.objects.create(username='owner')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_recent_private_chats(self):
+        members = [User.objects.create(username=f'member{i}') for i in range(30)]
+        group = ChatRoom.objects.create(name='everyone', created_by=self.user)
+        group.participants.add(self.user, *members)
+        friend = User.objects.create(username='friend')
+        room, _ = ChatRoom.get_or_create_private(self.user, friend)
+        Message.objects.create(room=room, user=friend, content='hi')
+
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/chat/rooms/available_users/')
+        self.assertEqual([contact['username'] for contact in response.json()['recent']], ['friend'])
+        response = self.client.get('/api/chat/rooms/available_users/', {'q': 'mem'})
+        self.assertEqual(response.json()['recent'], [])
+
+
+class FakeTransport:
+    def __init__(self):
+        self.producer = None
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+
+class OutboundBackpressureTests(SimpleTestCase):
+    """A paused transport backs frames up in the queue, where the policy applies"""
+
+    async def test_paused_transport(self):
+        sent = []
+
+        async def send(text_data=None, bytes_data=None):
+            sent.append(text_data)
+
+        async def close(code=None):
+            pass
+
+        transport = FakeTransport()
+        queue = OutboundQueue(send, close, max_size=3, transport=transport)
+        transport.producer.pauseProducing()
+        for number in range(5):
+            queue.put(str(number))
+        await asyncio.sleep(0)
+        self.assertEqual((sent, len(queue)), ([], 3))
+
+        transport.producer.resumeProducing()
+        await asyncio.sleep(0)
+        self.assertEqual(sent, ['2', '3', '4'])
+        queue.close()
+        self.assertIsNone(transport.producer)
+
+
+class PrivatePairMigrationTests(TransactionTestCase):
+    """Migration 0010 folds duplicate private chats into the oldest one"""
+
+    migrate_from = [('chat', '0009_user_directory_indexes')]
+    migrate_to = [('chat', '0010_chatroom_private_pair')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_merged(self):
+        apps = self.migrate(self.migrate_from)
+        User = apps.get_model('auth', 'User')
+        ChatRoom = apps.get_model('chat', 'ChatRoom')
+        Message = apps.get_model('chat', 'Message')
+        RoomParticipant = apps.get_model('chat', 'RoomParticipant')
+
+        alice, bob, carol = (User.objects.create(username=name) for name in ('alice', 'bob', 'carol'))
+        rooms = []
+        for members, messages in (((alice, bob), 2), ((bob, alice), 3), ((alice, bob), 1), ((alice, carol), 1)):
+            room = ChatRoom.objects.create(chat_type='private', created_by=members[0])
+            room.participants.add(*members)
+            for member in members:
+                RoomParticipant.objects.create(room=room, user=member)
+            for number in range(messages):
+                Message.objects.create(room=room, user=members[number % 2], content=f'{room.id}.{number}')
+            rooms.append(room)
+        group = ChatRoom.objects.create(name='group', created_by=alice)
+        group.participants.add(alice, bob)
+        Message.objects.create(room=group, user=alice, content='group')
+        read_upto = Message.objects.filter(room=rooms[1]).latest('id').id
+        RoomParticipant.objects.filter(room=rooms[1], user=alice).update(last_read_message_id=read_upto)
+        contents = set(Message.objects.values_list('content', flat=True))
+
+        apps = self.migrate(self.migrate_to)
+        ChatRoom = apps.get_model('chat', 'ChatRoom')
+        Message = apps.get_model('chat', 'Message')
+        RoomParticipant = apps.get_model('chat', 'RoomParticipant')
+
+        kept = ChatRoom.objects.get(private_pair=f'{alice.id}:{bob.id}')
+        self.assertEqual(kept.id, rooms[0].id)
+        self.assertEqual(
+            set(ChatRoom.objects.values_list('id', flat=True)), {rooms[0].id, rooms[3].id, group.id}
+        )
+        self.assertEqual(ChatRoom.objects.get(id=rooms[3].id).private_pair, f'{alice.id}:{carol.id}')
+        self.assertIsNone(ChatRoom.objects.get(id=group.id).private_pair)
+        # No message is lost, and the kept room points at the newest one
+        self.assertEqual(set(Message.objects.values_list('content', flat=True)), contents)
+        self.assertEqual(Message.objects.filter(room_id=kept.id).count(), 6)
+        self.assertEqual(kept.last_message_id, Message.objects.filter(room_id=kept.id).latest('timestamp', 'id').id)
+        self.assertEqual(RoomParticipant.objects.get(room_id=kept.id, user_id=alice.id).last_read_message_id, read_upto)
@@ -0,0 +1,179 @@
+import asyncio
+import time
+from functools import partial
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .groups import frame_event, room_group_name, send_to_group
+from .metrics import register_stats
+
+TYPING_DEFAULTS = {
+    'INTERVAL': 2.0,
+    'TIMEOUT': 5.0,
+}
+
+
+def get_typing_settings():
+    return {**TYPING_DEFAULTS, **getattr(settings, 'CHAT_TYPING', {})}
+
+
+class TypingThrottle:
+    """
+    Coalesce one user's typing signals in one room into rate-limited broadcasts.
+
+    Keystrokes call ``typing()``; ``on_change(True)`` fires at most once per
+    ``interval`` seconds while the user keeps typing. If no keystroke arrives
+    for ``timeout`` seconds, or the client says it stopped, ``on_change(False)``
+    fires once. Nothing here is persisted.
+    """
+
+    def __init__(self, on_change, interval=2.0, timeout=5.0):
+        self.on_change = on_change
+        self.interval = interval
+        self.timeout = timeout
+
+        self.is_typing = False
+        self.last_sent = 0.0
+        self.deadline = 0.0
+        self._expiry = None
+
+        # Counters
+        self.received = 0
+        self.sent = 0
+
+    async def typing(self):
+        now = time.monotonic()
+        self.received += 1
+        self.deadline = now + self.timeout
+        if self._expiry is None or self._expiry.done():
+            self._expiry = asyncio.get_running_loop().create_task(self._expire())
+
+        if not self.is_typing or now - self.last_sent >= self.interval:
+            self.is_typing = True
+            self.last_sent = now
+            await self._send(True)
+
+    async def stopped(self):
+        self.cancel()
+        if self.is_typing:
+            self.is_typing = False
+            await self._send(False)
+
+    def reset(self):
+        """Forget the typing state without broadcasting, e.g. after the user sent their message"""
+        self.cancel()
+        self.is_typing = False
+
+    def cancel(self):
+        if self._expiry is not None and not self._expiry.done():
+            self._expiry.cancel()
+        self._expiry = None
+
+    async def _expire(self):
+        while True:
+            delay = self.deadline - time.monotonic()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        self._expiry = None
+        if self.is_typing:
+            self.is_typing = False
+            await self._send(False)
+
+    async def _send(self, is_typing):
+        self.sent += 1
+        await self.on_change(is_typing)
+
+
+class TypingTracker:
+    """
+    In-process typing state, one throttle per (user, room).
+
+    All of a user's connections to a room share the throttle, so several
+    tabs or devices still broadcast at most once per ``interval``. The
+    throttle lives while at least one of those connections is in the room;
+    when the last one leaves the room hears that the user stopped typing.
+
+    State is per process, like presence: connections served by different
+    workers are throttled separately.
+    """
+
+    def __init__(self, interval=2.0, timeout=5.0):
+        self.interval = interval
+        self.timeout = timeout
+
+        self._throttles = {}  # (user_id, room_id) -> TypingThrottle
+        self._sessions = {}  # (user_id, room_id) -> {channel_name}
+
+    def throttle(self, room_id, user, channel_name):
+        """The user's throttle for the room, registering this connection with it"""
+        key = (user.id, room_id)
+        self._sessions.setdefault(key, set()).add(channel_name)
+        throttle = self._throttles.get(key)
+        if throttle is None:
+            throttle = self._throttles[key] = TypingThrottle(
+                partial(self.broadcast, room_id, user),
+                interval=self.interval,
+                timeout=self.timeout,
+            )
+        return throttle
+
+    def get(self, room_id, user_id):
+        return self._throttles.get((user_id, room_id))
+
+    def _release(self, room_id, user_id, channel_name):
+        """Unregister a connection; returns the throttle if it was the last one"""
+        key = (user_id, room_id)
+        sessions = self._sessions.get(key)
+        if sessions is None or channel_name not in sessions:
+            return None
+        sessions.discard(channel_name)
+        if sessions:
+            return None
+        del self._sessions[key]
+        return self._throttles.pop(key, None)
+
+    async def leave(self, room_id, user_id, channel_name):
+        """A connection left the room; the user's last one stops their indicator"""
+        throttle = self._release(room_id, user_id, channel_name)
+        if throttle is not None:
+            await throttle.stopped()
+
+    def drop(self, room_id, user_id, channel_name):
+        """Like leave, but without broadcasting (the room is gone or access was revoked)"""
+        throttle = self._release(room_id, user_id, channel_name)
+        if throttle is not None:
+            throttle.cancel()
+
+    async def broadcast(self, room_id, user, is_typing):
+        await send_to_group(
+            get_channel_layer(),
+            room_group_name(room_id),
+            frame_event('user_typing', {
+                'type': 'typing',
+                'room_id': room_id,
+                'is_typing': is_typing,
+                'user': user.username,
+                'user_id': user.id
+            }, user_id=user.id, coalesce_key=f'typing:{room_id}:{user.id}')
+        )
+
+    def stats(self):
+        return {
+            'typists': len(self._throttles),
+            'connections': sum(len(sessions) for sessions in self._sessions.values()),
+        }
+
+
+_typing = None
+
+
+def get_typing():
+    """Return the process-wide typing tracker, creating it on first use"""
+    global _typing
+    if _typing is None:
+        conf = get_typing_settings()
+        _typing = TypingTracker(interval=conf['INTERVAL'], timeout=conf['TIMEOUT'])
+        register_stats('chat_typing', _typing.stats, 'Typing indicators')
+    return _typing
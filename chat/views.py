@@ -1,13 +1,17 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from django.db.models import Count, Q, Prefetch, Subquery, OuterRef
+from django.db.models import Count, FilteredRelation, Q, Prefetch, Subquery, OuterRef
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from rest_framework.permissions import AllowAny
 from .models import ChatRoom, Message, RoomParticipant
+from .directory import recent_contacts, search_directory
+from .pagination import MessageCursorPagination, parse_id
+from .search import search_messages
 from .serializers import (
     ChatRoomListSerializer, MessageSerializer, ChatRoomDetailSerializer,
-    PrivateChatCreateSerializer, UserSerializer
+    MessageSearchResultSerializer, PrivateChatCreateSerializer, UserDirectorySerializer
 )
 
 class ChatRoomViewSet(viewsets.ModelViewSet):
@@ -15,19 +19,45 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         user = self.request.user
-        # Get the latest message for each room using subquery
-        latest_message_subquery = Message.objects.filter(
-            room=OuterRef('pk')
-        ).order_by('-timestamp').values('content', 'user__username', 'timestamp')[:1]
+        if self.action not in ('list', 'my_chats'):
+            # Single-room actions don't need the inbox annotations; only the
+            # detail view lists the members
+            queryset = ChatRoom.objects.filter(participants=user).select_related('created_by')
+            if self.action == 'retrieve':
+                queryset = queryset.prefetch_related('participants')
+            return queryset
+
+        memberships = ChatRoom.participants.through.objects.filter(chatroom=OuterRef('pk'))
+
+        # Username of the other member, used as the display name of private chats
+        other_participant_subquery = memberships.exclude(user=user).values('user__username')[:1]
+
+        # Counted per room on the participants index; a Count() over the join
+        # used by filter(participants=user) would only ever see one row and
+        # force a GROUP BY over every selected column
+        participant_count_subquery = memberships.values('chatroom').annotate(
+            count=Count('*')
+        ).values('count')
+        
+        # Messages from others above the user's read cursor, counted on the
+        # (room, id) index; the cursor comes from a single join on RoomParticipant
+        unread_subquery = Message.objects.filter(
+            room=OuterRef('pk'),
+            id__gt=Coalesce(OuterRef('membership__last_read_message_id'), 0),
+        ).exclude(user=user).values('room').annotate(
+            count=Count('*')
+        ).values('count')
         
+        # Newest activity first; last_message is denormalized on the room
         queryset = ChatRoom.objects.filter(
             participants=user
         ).annotate(
-            participant_count=Count('participants'),
-            last_message_content=Subquery(latest_message_subquery.values('content')),
-            last_message_user=Subquery(latest_message_subquery.values('user__username')),
-            last_message_time=Subquery(latest_message_subquery.values('timestamp'))
-        ).order_by('-last_message_time', '-created_at')
+            membership=FilteredRelation('active_participants', condition=Q(active_participants__user=user)),
+        ).annotate(
+            participant_count=Subquery(participant_count_subquery),
+            other_participant_username=Subquery(other_participant_subquery),
+            unread_count=Coalesce(Subquery(unread_subquery), 0),
+        ).select_related('last_message__user').order_by('-last_activity_at', '-id')
         
         return queryset
 
@@ -88,47 +118,43 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            # Check if private chat already exists
-            existing_chat = ChatRoom.objects.filter(
-                chat_type='private',
-                participants=request.user
-            ).filter(
-                participants=other_user
-            ).annotate(
-                participant_count=Count('participants')
-            ).filter(participant_count=2).first()
-            
-            if existing_chat:
-                serializer = ChatRoomDetailSerializer(existing_chat, context={'request': request})
-                return Response(serializer.data)
-            
-            # Create new private chat
-            chat_room = ChatRoom.objects.create(
-                chat_type='private',
-                created_by=request.user
-            )
-            chat_room.participants.add(request.user, other_user)
+            # One probe of the unique pair key; safe against concurrent requests
+            chat_room, created = ChatRoom.get_or_create_private(request.user, other_user)
             
             serializer = ChatRoomDetailSerializer(chat_room, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(serializer.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=False, methods=['get'])
     def available_users(self, request):
-        """Get list of users available for chatting"""
-        current_user = request.user
-        users = User.objects.exclude(id=current_user.id)
-        serializer = UserSerializer(users, many=True)
-        return Response(serializer.data)
+        """Search users available for chatting by name prefix, one page at a time"""
+        prefix = request.query_params.get('q', '').strip()
+        after = request.query_params.get('after')
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 20)), 100))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        users, has_more = search_directory(request.user, prefix, after=after, limit=limit)
+        data = {
+            'results': UserDirectorySerializer(users, many=True).data,
+            'has_more': has_more,
+            'next': users[-1].username if has_more else None,
+        }
+        # The first page also lists people the caller recently talked to
+        if not after:
+            data['recent'] = UserDirectorySerializer(recent_contacts(request.user, prefix), many=True).data
+        return Response(data)
 
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
-        """Get all messages for a specific room"""
+        """Get a cursor-paginated page of messages for a specific room"""
         room = self.get_object()
-        messages = room.messages.all().select_related('user').order_by('timestamp')
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        paginator = MessageCursorPagination()
+        page = paginator.paginate_queryset(room.messages.select_related('user'), request, view=self)
+        serializer = MessageSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
 
 class MessageViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
@@ -185,4 +211,32 @@ def register_user(request):
         'message': 'User created successfully',
         'user_id': user.id,
         'username': user.username
-    }, status=status.HTTP_201_CREATED)
\ No newline at end of file
+    }, status=status.HTTP_201_CREATED)
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def message_search(request):
+    """Ranked full-text search over messages in the caller's rooms"""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+    room_id = None
+    if request.query_params.get('room'):
+        room_id = parse_id(request.query_params['room'])
+        if room_id is None:
+            return Response({'error': 'room must be a room id'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = max(1, min(int(request.query_params.get('limit', 20)), 100))
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+    results, has_more, next_cursor, truncated = search_messages(
+        request.user, query, room_id=room_id, cursor=request.query_params.get('cursor'), limit=limit
+    )
+    # truncated: only the newest CHAT_SEARCH MAX_CANDIDATES matches were ranked
+    return Response({
+        'results': MessageSearchResultSerializer(results, many=True).data,
+        'has_more': has_more,
+        'next': next_cursor,
+        'truncated': truncated,
+    })
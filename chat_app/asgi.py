@@ -10,18 +10,20 @@ django.setup()
 
 # Now import WebSocket components AFTER Django setup
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from django.urls import re_path
-from chat.consumers import ChatConsumer
+from chat.consumers import ChatConsumer, MultiplexChatConsumer
+from chat.middleware import JWTAuthMiddlewareStack
 
 # WebSocket URL patterns
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<room_name>\w+)/$', ChatConsumer.as_asgi()),
+    # One connection for many rooms, driven by subscribe/unsubscribe frames
+    re_path(r'ws/chat/$', MultiplexChatConsumer.as_asgi()),
 ]
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "websocket": JWTAuthMiddlewareStack(
         URLRouter(
             websocket_urlpatterns
         )
@@ -2,15 +2,34 @@
 Django settings for chat_app project.
 """
 import os
+import sys
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-SECRET_KEY = 'django-insecure-chat-websocket-api-secret-key-2024'
+# DJANGO_ENV=production switches the defaults below to the production profile:
+# DEBUG off (no per-query capture), secret key, hosts and metrics token from
+# the environment, persistent database connections and a pool of database
+# threads
+DJANGO_ENV = os.environ.get('DJANGO_ENV', 'development')
+PRODUCTION = DJANGO_ENV == 'production'
+
+
+def env_flag(name, default):
+    return os.environ.get(name, '1' if default else '0').lower() in ('1', 'true', 'yes', 'on')
+
 
-DEBUG = True
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY')
+if not SECRET_KEY:
+    if PRODUCTION:
+        raise ImproperlyConfigured('DJANGO_SECRET_KEY must be set in production')
+    SECRET_KEY = 'django-insecure-chat-websocket-api-secret-key-2024'
 
-ALLOWED_HOSTS = ['localhost', '127.0.0.1', '0.0.0.0']
+DEBUG = env_flag('DEBUG', not PRODUCTION)
+
+ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', '' if PRODUCTION else 'localhost 127.0.0.1 0.0.0.0').split()
 
 # Application definition
 INSTALLED_APPS = [
@@ -58,14 +77,53 @@ TEMPLATES = [
     },
 ]
 
-# Database
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Database: DB_ENGINE=postgresql uses the POSTGRES_* variables, otherwise
+# SQLite at SQLITE_PATH. CONN_MAX_AGE keeps connections open across requests
+# and WebSocket calls (checked before reuse when CONN_HEALTH_CHECKS is on).
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite3')
+CONN_MAX_AGE = int(os.environ.get('CONN_MAX_AGE', 60 if PRODUCTION else 0))
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'chat'),
+            'USER': os.environ.get('POSTGRES_USER', 'chat'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Seconds a writer waits for the lock before "database is locked"
+                'timeout': 20,
+            },
+        }
     }
+
+# SQLite tuning (chat.db). The journal mode is stored in the database file,
+# so it is checked on the first connection of a process and only switched if
+# it differs; WAL lets readers proceed while a message is being written. It
+# is on in the production profile only, so development commands leave the
+# committed db.sqlite3 alone. The pragmas run on every new connection.
+CHAT_SQLITE_JOURNAL_MODE = os.environ.get('CHAT_SQLITE_JOURNAL_MODE', 'WAL' if PRODUCTION else '')
+CHAT_SQLITE_PRAGMAS = {
+    'synchronous': 'NORMAL',
 }
 
+# Threads running WebSocket database work (chat.db.database_sync_to_async).
+# 0 keeps channels' default of a single shared thread per process.
+CHAT_DB_THREADS = int(os.environ.get('CHAT_DB_THREADS', 8 if PRODUCTION else 0))
+
 # Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -101,20 +159,37 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:8000",
 ]
 
-CORS_ALLOW_ALL_ORIGINS = True  # Only for development
+CORS_ALLOW_ALL_ORIGINS = not PRODUCTION  # Only for development
 
 # Channels configuration
 ASGI_APPLICATION = 'chat_app.asgi.application'
 
 # Channel layers with Redis
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        'CONFIG': {
-            "hosts": [('redis', 6379)],
+# CHANNEL_LAYER=local keeps groups in process (chat.layers.LocalChannelLayer):
+# no Redis needed, but only connections to this one process see each other.
+# It is the default under "manage.py test", so the suite runs without Redis.
+TESTING = sys.argv[1:2] == ['test']
+CHANNEL_LAYER = os.environ.get('CHANNEL_LAYER', 'local' if TESTING else 'redis')
+
+if CHANNEL_LAYER == 'local':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'chat.layers.LocalChannelLayer',
+            'CONFIG': {
+                'capacity': 100,
+                'expiry': 60,
+            },
         },
-    },
-}
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {
+                "hosts": [(os.environ.get('REDIS_HOST', 'redis'), int(os.environ.get('REDIS_PORT', 6379)))],
+            },
+        },
+    }
 
 # Internationalization
 LANGUAGE_CODE = 'en-us'
@@ -129,4 +204,155 @@ STATIC_URL = '/static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # WSGI configuration (needed for Django)
-WSGI_APPLICATION = 'chat_app.wsgi.application'
\ No newline at end of file
+WSGI_APPLICATION = 'chat_app.wsgi.application'
+
+# Message persistence
+# 'sync' saves every message before it is broadcast. 'write_behind' broadcasts
+# right away and persists messages in batches with bulk_create; at most
+# MAX_PENDING messages / FLUSH_INTERVAL seconds of traffic can be lost on crash.
+# Write-behind broadcasts messages without ids, so it turns off CHAT_RESUME.
+CHAT_MESSAGE_PERSISTENCE = {
+    'MODE': os.environ.get('CHAT_PERSISTENCE_MODE', 'sync'),
+    'BATCH_SIZE': 100,
+    'FLUSH_INTERVAL': 0.05,  # seconds
+    'MAX_PENDING': 5000,
+}
+
+# WebSocket JWT authentication cache (users resolved from access tokens)
+CHAT_AUTH_CACHE = {
+    'MAX_SIZE': 10000,
+    'TTL': 300,  # seconds; also capped by each token's exp
+}
+
+# Logging
+# The chat app logs structured JSON events through a queue handler so the event
+# loop never blocks on log I/O; per-message DEBUG events are sampled per event.
+CHAT_LOG_LEVEL = os.environ.get('CHAT_LOG_LEVEL', 'INFO')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            '()': 'chat.log.StructuredFormatter',
+        },
+    },
+    'filters': {
+        'sampled_debug': {
+            '()': 'chat.log.SampledFilter',
+            'level': 'DEBUG',
+            'rate': 20,  # records per event name
+            'per': 1.0,  # seconds
+        },
+    },
+    'handlers': {
+        'chat_queue': {
+            'class': 'chat.log.QueueingStreamHandler',
+            'formatter': 'structured',
+            'filters': ['sampled_debug'],
+            'stream': 'ext://sys.stdout',
+            'max_queue_size': 10000,
+        },
+    },
+    'loggers': {
+        'chat': {
+            'handlers': ['chat_queue'],
+            'level': CHAT_LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
+# Number of latest messages embedded in room detail responses
+CHAT_RECENT_MESSAGES = 50
+
+# Presence: sessions idle for TTL seconds expire; online/offline changes are
+# written to RoomParticipant in batches every FLUSH_INTERVAL seconds
+CHAT_PRESENCE = {
+    'TTL': 60,
+    'FLUSH_INTERVAL': 2.0,
+}
+
+# Typing indicators: at most one broadcast per INTERVAL seconds per user and
+# room, and an automatic "stopped typing" after TIMEOUT seconds of silence
+CHAT_TYPING = {
+    'INTERVAL': 2.0,
+    'TIMEOUT': 5.0,
+}
+
+# JSON encoder for WebSocket frames: 'auto' uses orjson when installed
+CHAT_JSON_ENCODER = os.environ.get('CHAT_JSON_ENCODER', 'auto')
+
+# Per-connection outbound queue. POLICY is what happens when MAX_SIZE frames
+# are pending: 'drop_oldest', 'coalesce' (typing/presence frames replace each
+# other) or 'disconnect' (close with CLOSE_CODE so the client resumes).
+# Frames pile up here while the client's socket is backed up; under daphne
+# that is detected through the Twisted transport (chat.outbound.OutboundQueue).
+CHAT_OUTBOUND = {
+    'MAX_SIZE': 256,
+    'POLICY': os.environ.get('CHAT_OUTBOUND_POLICY', 'drop_oldest'),
+    'CLOSE_CODE': 4008,
+}
+
+# Inbound limits for chat WebSocket frames. USER/ROOM are token buckets
+# (RATE per second, BURST capacity) applied to messages and read receipts;
+# BACKEND 'local' keeps them in process, 'cache' shares fixed-window counters
+# through the CACHE alias across workers. Frames above MAX_FRAME_SIZE close
+# the socket with 1009; MAX_VIOLATIONS rejected frames close it with CLOSE_CODE.
+CHAT_RATE_LIMITS = {
+    'BACKEND': os.environ.get('CHAT_RATE_LIMIT_BACKEND', 'local'),
+    'CACHE': 'default',
+    'USER': {'RATE': 5, 'BURST': 10},
+    'ROOM': {'RATE': 50, 'BURST': 100},
+    'MAX_FRAME_SIZE': 16384,  # characters, checked before json.loads
+    'MAX_MESSAGE_LENGTH': 4000,
+    'MAX_VIOLATIONS': 10,
+    'CLOSE_CODE': 4029,
+}
+
+# WebSocket wire protocols clients may pick through Sec-WebSocket-Protocol
+# (space-separated in the environment). JSON text frames are always on;
+# 'chat.msgpack' is MessagePack with short keys, 'chat.msgpack.deflate'
+# additionally deflates frames >= MIN_SIZE bytes. Both are opt-in: broadcasts
+# are encoded once per protocol with connections in the process.
+CHAT_WIRE_PROTOCOLS = os.environ.get('CHAT_WIRE_PROTOCOLS', 'chat.json').split()
+CHAT_WIRE_COMPRESSION = {
+    'MIN_SIZE': 512,
+    'LEVEL': 6,
+}
+
+# WebSocket resume: clients reconnect with ?last_message_id= (or a 'resume'
+# frame) and get missed messages in history frames of BATCH_SIZE, at most
+# MAX_MESSAGES in total before the 'live' marker. Resume needs the message id
+# in every broadcast, which write-behind persistence can't provide (queued
+# messages have none yet), so it is off in that mode; the two together are
+# refused at startup.
+CHAT_RESUME = {
+    'ENABLED': CHAT_MESSAGE_PERSISTENCE['MODE'] != 'write_behind',
+    'BATCH_SIZE': 100,
+    'MAX_MESSAGES': 1000,
+}
+
+# Multiplexed endpoint (ws/chat/): rooms one connection may subscribe to
+CHAT_MULTIPLEX = {
+    'MAX_ROOMS': 100,
+}
+
+# Message search (/api/chat/messages/search/): matches are limited to the caller's
+# rooms inside the index, and only the newest MAX_CANDIDATES of them are
+# ranked, which bounds the cost of common terms. Responses say "truncated"
+# when older matches were left out.
+CHAT_SEARCH = {
+    'MAX_CANDIDATES': 1000,
+}
+
+# Prometheus metrics at /metrics/. PER_ROOM exports a connection gauge per
+# room with open connections (one series each; turn off for very many rooms).
+# With TOKEN set, scrapes must send "Authorization: Bearer <TOKEN>"; the
+# production profile requires one, since the metrics name rooms and internals.
+CHAT_METRICS = {
+    'PER_ROOM': env_flag('CHAT_METRICS_PER_ROOM', True),
+    'TOKEN': os.environ.get('CHAT_METRICS_TOKEN'),
+}
+if PRODUCTION and not CHAT_METRICS['TOKEN']:
+    raise ImproperlyConfigured('CHAT_METRICS_TOKEN must be set in production')
@@ -1,10 +1,13 @@
+import hmac
+
 from django.contrib import admin
 from django.urls import path, include
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from chat import metrics as chat_metrics
 
 # API Documentation
 schema_view = get_schema_view(
@@ -28,6 +31,8 @@ def api_root(request):
             'auth_refresh': '/api/auth/token/refresh/',
             'chat_rooms': '/api/chat/rooms/',
             'chat_messages': '/api/chat/messages/',
+            'message_search': '/api/chat/messages/search/?q={terms}',
+            'metrics': '/metrics/',
             'websocket_endpoint': 'ws://localhost:8000/ws/chat/{room_id}/'
         },
         'webSocket_events': {
@@ -39,11 +44,19 @@ def api_root(request):
         }
     })
 
+def metrics(request):
+    """Process metrics in the Prometheus text format"""
+    token = chat_metrics.get_metrics_settings()['TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(chat_metrics.render(), content_type=chat_metrics.CONTENT_TYPE)
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/chat/', include('chat.urls')),
     path('api/auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
+    path('metrics/', metrics, name='metrics'),
     path('', api_root, name='api-root'),
 ]
\ No newline at end of file